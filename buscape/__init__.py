@@ -1 +1,12 @@
-from buscape import Buscape
\ No newline at end of file
+from barcodes import BarcodeIndex, BarcodeResolver
+from buscape import Buscape, AsyncBuscape, ConnectionPool
+from buscape import TruncatedResultsWarning
+from cache import LRUCache, SQLiteCache, TieredCache
+from categories import CategoryIndex
+from columns import Columns
+from feed import OfferChange, PriceFeed
+from metrics import MetricsCollector
+from models import Offer, Product, Seller, Category, UserRating, Result
+from ratelimit import RateLimiter, TokenBucket
+from retry import RetryPolicy
+from scheduler import WatchlistScheduler
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+Resolução de códigos de barras (EAN/GTIN) em productID, com um índice
+local persistente.
+"""
+
+import os
+import struct
+import sys
+import threading
+import time
+
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from multiprocessing.pool import ThreadPool
+
+# Cabeçalho do arquivo: assinatura, versão, tamanho dos itens e número de
+# entradas
+MAGIC = 'BPBC'
+FORMAT_VERSION = 2
+_HEADER = struct.Struct('<4sIII')
+
+# Códigos e productIDs ficam em array('d'): o Python 2 não tem array de
+# inteiros de 64 bits ('l' tem 32 bits no Windows e em builds de 32 bits),
+# e um double representa exatamente inteiros até 2 ** 53, bem acima dos 14
+# dígitos de um GTIN. Assim o arquivo não depende da plataforma.
+_TYPECODE = 'd'
+_ITEMSIZE = 8
+
+# productID guardado para códigos que a API não conhece
+UNKNOWN = 0
+
+
+def barcode_key(barcode):
+    """
+    Código de barras como inteiro. Zeros à esquerda não contam, de modo
+    que o mesmo GTIN em UPC-A (12 dígitos) e EAN-13 tem a mesma chave.
+    """
+    code = str(barcode).strip()
+    if not code.isdigit() or len(code) > 14:
+        raise ValueError('invalid barcode: {0!r}'.format(barcode))
+    return int(code)
+
+
+class BarcodeIndex(object):
+    """
+    Índice código de barras -> (productID, quando foi resolvido), em três
+    arrays de doubles ordenados pelo código (24 bytes por entrada), com
+    busca binária. As entradas novas ficam em um dict até serem
+    incorporadas aos arrays (a cada merge_every entradas, ou ao gravar).
+
+    O arquivo gravado por save() é o mesmo em qualquer plataforma (doubles
+    little-endian).
+    """
+
+    merge_every = 10000
+
+    def __init__(self, path=None):
+        self.path = path
+        self._codes = array(_TYPECODE)
+        self._products = array(_TYPECODE)
+        self._times = array(_TYPECODE)
+        self._pending = {}
+        self._lock = threading.Lock()
+
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def get(self, code):
+        """
+        (productID, resolved_at) de code, ou None. productID é UNKNOWN
+        para os códigos que a API não encontrou.
+        """
+        with self._lock:
+            entry = self._pending.get(code)
+            if entry is not None:
+                return entry
+
+            i = bisect_left(self._codes, code)
+            if i < len(self._codes) and self._codes[i] == code:
+                return int(self._products[i]), self._times[i]
+        return None
+
+    def set(self, code, productID, resolved_at=None):
+        if resolved_at is None:
+            resolved_at = time.time()
+        with self._lock:
+            self._pending[code] = (productID or UNKNOWN, resolved_at)
+            if len(self._pending) >= self.merge_every:
+                self._merge()
+
+    def __len__(self):
+        with self._lock:
+            self._merge()
+            return len(self._codes)
+
+    def _merge(self):
+        if not self._pending:
+            return
+
+        codes, products, times = self._codes, self._products, self._times
+        new_codes = array(_TYPECODE)
+        new_products = array(_TYPECODE)
+        new_times = array(_TYPECODE)
+
+        i = 0
+        for code in sorted(self._pending):
+            while i < len(codes) and codes[i] < code:
+                new_codes.append(codes[i])
+                new_products.append(products[i])
+                new_times.append(times[i])
+                i += 1
+            if i < len(codes) and codes[i] == code:
+                i += 1
+            productID, resolved_at = self._pending[code]
+            new_codes.append(code)
+            new_products.append(productID)
+            new_times.append(resolved_at)
+
+        new_codes.extend(codes[i:])
+        new_products.extend(products[i:])
+        new_times.extend(times[i:])
+
+        self._codes, self._products, self._times = \
+            new_codes, new_products, new_times
+        self._pending = {}
+
+    def save(self, path=None):
+        """
+        Grava o índice em path (por padrão, o path do construtor). O
+        arquivo é substituído de uma vez só.
+        """
+        path = path or self.path
+        if path is None:
+            raise ValueError('path must be specified')
+
+        with self._lock:
+            self._merge()
+            tmp = '%s.%d.tmp' % (path, os.getpid())
+            with open(tmp, 'wb') as f:
+                f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, _ITEMSIZE,
+                                     len(self._codes)))
+                for column in (self._codes, self._products, self._times):
+                    if sys.byteorder == 'big':
+                        column = array(_TYPECODE, column)
+                        column.byteswap()
+                    column.tofile(f)
+            os.rename(tmp, path)
+
+    def load(self, path):
+        with open(path, 'rb') as f:
+            magic, version, itemsize, count = _HEADER.unpack(
+                f.read(_HEADER.size))
+            if magic != MAGIC or version != FORMAT_VERSION or \
+                    itemsize != _ITEMSIZE:
+                raise ValueError('unsupported barcode index: {0}'
+                                 ''.format(path))
+
+            columns = []
+            for i in range(3):
+                column = array(_TYPECODE)
+                column.fromfile(f, count)
+                if sys.byteorder == 'big':
+                    column.byteswap()
+                columns.append(column)
+            codes, products, times = columns
+
+        with self._lock:
+            self._codes, self._products, self._times = codes, products, times
+            self._pending = {}
+
+
+class BarcodeResolver(object):
+    """
+    Resolve códigos de barras em productID usando find_offer_list(barcode=)
+    e guarda as respostas em um BarcodeIndex persistente (em path). Os
+    códigos que a API não conhece também são guardados, por negative_ttl
+    segundos; ttl (None: para sempre) limita o tempo das demais entradas.
+
+        resolver = BarcodeResolver(buscape, 'barcodes.idx')
+        ids = resolver.resolve_barcodes(eans)
+    """
+
+    def __init__(self, client, path=None, ttl=None, negative_ttl=7 * 86400,
+                 concurrency=8):
+        if not isinstance(concurrency, int) or concurrency < 1:
+            raise ValueError('concurrency must be a positive integer')
+
+        self.client = client
+        self.index = BarcodeIndex(path)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.concurrency = concurrency
+
+    def cached(self, barcode):
+        """
+        (True, productID ou None) se o código está no índice e não
+        expirou, (False, None) se não.
+        """
+        entry = self.index.get(barcode_key(barcode))
+        if entry is None:
+            return False, None
+
+        productID, resolved_at = entry
+        ttl = self.negative_ttl if productID == UNKNOWN else self.ttl
+        if ttl is not None and resolved_at + ttl <= time.time():
+            return False, None
+        return True, productID if productID != UNKNOWN else None
+
+    def __lookup(self, code, barcode):
+        result = self.client._wait(self.client.find_offer_list(
+            barcode=str(barcode).strip(), fields=('product_id',)))
+
+        # O produto com mais ofertas para o código
+        counts = Counter(offer.product_id for offer in result.items
+                         if offer.product_id)
+        productID = counts.most_common(1)[0][0] if counts else None
+        self.index.set(code, productID)
+        return productID
+
+    def resolve(self, barcode):
+        """
+        productID do código de barras, ou None se a API não o conhece.
+        """
+        found, productID = self.cached(barcode)
+        if found:
+            return productID
+        return self.__lookup(barcode_key(barcode), barcode)
+
+    def resolve_barcodes(self, barcodes, errors=None):
+        """
+        dict {código: productID ou None} para todos os códigos. Só os que
+        não estão no índice vão para a API, com até concurrency requisições
+        simultâneas, e o índice é gravado no final.
+
+        Se errors for um dict, os códigos cujas requisições falharam ficam
+        fora do resultado e vão para errors ({código: exceção}); senão a
+        primeira falha é levantada depois que todas as requisições
+        terminam (as respostas obtidas ficam no índice).
+        """
+        resolved = {}
+        missing = {}
+        for barcode in barcodes:
+            found, productID = self.cached(barcode)
+            if found:
+                resolved[barcode] = productID
+            else:
+                missing.setdefault(barcode_key(barcode), []).append(barcode)
+
+        if not missing:
+            return resolved
+
+        def run(code):
+            try:
+                return self.__lookup(code, missing[code][0]), None
+            except Exception, e:
+                return None, e
+
+        codes = list(missing)
+        workers = ThreadPool(min(self.concurrency, len(codes)))
+        try:
+            outcomes = workers.map(run, codes, 1)
+        finally:
+            workers.close()
+            workers.join()
+
+        if self.index.path is not None:
+            self.index.save()
+
+        failure = None
+        for code, (productID, error) in zip(codes, outcomes):
+            for barcode in missing[code]:
+                if error is None:
+                    resolved[barcode] = productID
+                elif errors is not None:
+                    errors[barcode] = error
+                elif failure is None:
+                    failure = error
+
+        if failure is not None:
+            raise failure
+        return resolved
+
+    def save(self, path=None):
+        self.index.save(path)
@@ -4,10 +4,27 @@
 __author__ = "Igor Hercowitz, Alê Borba"
 __version__ = "v0.6.1"
 
+import httplib
+import multiprocessing
 import socket
-
+import sys
+import threading
+import time
+import warnings
+import zlib
+
+from contextlib import contextmanager
+from cStringIO import StringIO
+from functools import partial, wraps
+from multiprocessing.pool import ThreadPool
 from urllib import urlencode
-from urllib2 import urlopen, URLError, HTTPError
+from urllib2 import URLError, HTTPError
+from urlparse import urlsplit
+
+from cache import LRUCache
+from columns import OFFER_FIELDS, Columns
+from models import MODELS, projection
+from parser import StreamParser, parse_page, parse_result
 
 # Valores válidos para filtro sort
 SORT_VALUES = ['price', 'dprice', 'rate', 'drate', 'seller', 'dseller',
@@ -19,12 +36,469 @@ MEDAL_VALUES = ['all', 'diamond', 'gold', 'silver', 'bronze']
 
 COUNTRIES = ['AR', 'BR', 'CL', 'CO', 'MX', 'PE', 'VE']
 
-class Buscape():
+# Métodos aceitos por Buscape.search_countries
+COUNTRY_METHODS = ('find_product_list', 'find_offer_list', 'top_products')
+
+# Métodos cuja resposta bruta fica em Result.data com models: o que
+# interessa nelas (sourceId, especificações, endereços) não vira modelo
+RAW_DATA_METHODS = ('createSource', 'viewProductDetails',
+                    'viewSellerDetails')
+
+# Maior página aceita pelo filtro page
+MAX_PAGE = 998
+
+# Eventos aceitos por Buscape.add_hook
+HOOKS = ('before_request', 'after_response', 'on_error')
+
+# Tempo padrão (em segundos) que cada tipo de resposta fica no cache.
+# Métodos ausentes (ex.: createSource) nunca são cacheados.
+CACHE_TTLS = {
+    'findCategoryList': 6 * 60 * 60,
+    'viewProductDetails': 60 * 60,
+    'viewSellerDetails': 60 * 60,
+    'viewUserRatings': 60 * 60,
+    'findProductList': 10 * 60,
+    'topProducts': 10 * 60,
+    'findOfferList': 30,
+}
+
+
+class _DeflateDecoder(object):
+    """
+    Descompressor para Content-Encoding: deflate, que na prática pode vir
+    com ou sem o cabeçalho zlib.
+    """
+
+    def __init__(self):
+        self._decoder = zlib.decompressobj()
+        self._first = True
+
+    def decompress(self, data):
+        if not self._first:
+            return self._decoder.decompress(data)
+
+        self._first = False
+        try:
+            return self._decoder.decompress(data)
+        except zlib.error:
+            self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self._decoder.decompress(data)
+
+    def flush(self):
+        return self._decoder.flush()
+
+
+class PooledResponse(object):
+    """
+    Resposta HTTP obtida através do ConnectionPool. Quando o corpo é lido
+    até o fim a conexão volta para o pool; fechar a resposta antes disso
+    descarta a conexão.
+
+    Respostas com gzip ou deflate são descompactadas à medida que são
+    lidas.
+    """
+
+    def __init__(self, pool, key, conn, resp):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._resp = resp
+        self.code = resp.status
+        self.msg = resp.reason
+        self.headers = resp.msg
+
+        encoding = (resp.getheader('content-encoding') or '').lower()
+        if encoding in ('gzip', 'x-gzip'):
+            self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            self._decoder = _DeflateDecoder()
+        else:
+            self._decoder = None
+        self._buffer = ''
+        self._eof = False
+
+    def _read_raw(self, amt=None):
+        try:
+            data = self._resp.read(amt)
+        except (httplib.HTTPException, socket.error), e:
+            self.close()
+            raise URLError(e)
+        if self._resp.isclosed():
+            self._eof = True
+            self._release()
+        self._pool._count(len(data), 0)
+        return data
+
+    def _decode(self, data, final=False):
+        try:
+            data = self._decoder.decompress(data)
+            if final:
+                data += self._decoder.flush()
+        except zlib.error, e:
+            self.close()
+            raise URLError(e)
+        return data
+
+    def read(self, amt=None):
+        if self._decoder is None:
+            data = self._read_raw(amt)
+        elif amt is None:
+            data = self._buffer + self._decode(self._read_raw(), final=True)
+            self._buffer = ''
+        else:
+            while len(self._buffer) < amt and not self._eof:
+                raw = self._read_raw(amt)
+                self._buffer += self._decode(raw, final=self._eof)
+            data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+
+        self._pool._count(0, len(data))
+        return data
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _release(self):
+        if self._conn is not None:
+            if self._resp.will_close:
+                self._conn.close()
+            else:
+                self._pool._put(self._key, self._conn)
+            self._conn = None
+
+
+class ConnectionPool(object):
+    """
+    Pool de conexões HTTP keep-alive, separadas por host (bws/sandbox).
+
+    maxsize limita quantas conexões ociosas são mantidas por host e
+    idle_timeout (em segundos) quanto tempo uma conexão ociosa pode ficar
+    no pool antes de ser descartada. Com compress as respostas são pedidas
+    com gzip/deflate; bytes_wire e bytes_decoded contam os bytes recebidos
+    e os bytes entregues depois de descompactados.
+    """
+
+    def __init__(self, maxsize=10, idle_timeout=60, compress=True):
+        if not isinstance(maxsize, int) or maxsize < 1:
+            raise ValueError('maxsize must be a positive integer')
+
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.compress = compress
+        self.bytes_wire = 0
+        self.bytes_decoded = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _count(self, wire, decoded):
+        with self._lock:
+            self.bytes_wire += wire
+            self.bytes_decoded += decoded
+
+    def stats(self):
+        with self._lock:
+            return dict(bytes_wire=self.bytes_wire,
+                        bytes_decoded=self.bytes_decoded)
+
+    def _evict(self, now):
+        # Chamado com o lock adquirido
+        for key, conns in self._idle.items():
+            alive = []
+            for conn, last_used in conns:
+                if now - last_used < self.idle_timeout:
+                    alive.append((conn, last_used))
+                else:
+                    conn.close()
+            if alive:
+                self._idle[key] = alive
+            else:
+                del self._idle[key]
+
+    def _get(self, key):
+        with self._lock:
+            self._evict(time.time())
+            conns = self._idle.get(key)
+            if conns:
+                return conns.pop()[0]
+        return None
+
+    def _put(self, key, conn):
+        with self._lock:
+            now = time.time()
+            self._evict(now)
+            conns = self._idle.setdefault(key, [])
+            if len(conns) < self.maxsize:
+                conns.append((conn, now))
+                return
+        conn.close()
+
+    def _connect(self, conn, timeout):
+        if isinstance(timeout, tuple):
+            connect_timeout, read_timeout = timeout
+        else:
+            connect_timeout = read_timeout = timeout
+
+        # Uma conexão reaproveitada não pode ficar com o timeout da
+        # requisição anterior: sem timeout vale o padrão do módulo socket
+        if conn.sock is None:
+            if connect_timeout is None:
+                conn.timeout = socket._GLOBAL_DEFAULT_TIMEOUT
+            else:
+                conn.timeout = connect_timeout
+            conn.connect()
+        if read_timeout is None:
+            read_timeout = socket.getdefaulttimeout()
+        conn.sock.settimeout(read_timeout)
+
+    def _new_conn(self, scheme, netloc):
+        if scheme == 'https':
+            return httplib.HTTPSConnection(netloc)
+        return httplib.HTTPConnection(netloc)
+
+    def idle_connections(self, key=None):
+        """
+        Número de conexões ociosas no pool, no total ou para um host
+        (scheme, netloc).
+        """
+        with self._lock:
+            self._evict(time.time())
+            if key is not None:
+                return len(self._idle.get(key, []))
+            return sum(len(conns) for conns in self._idle.values())
+
+    def clear(self):
+        """
+        Fecha todas as conexões ociosas.
+        """
+        with self._lock:
+            for conns in self._idle.values():
+                for conn, last_used in conns:
+                    conn.close()
+            self._idle.clear()
+
+    def urlopen(self, url, headers=None, timeout=None):
+        """
+        Faz um GET em url reutilizando uma conexão do pool quando houver.
+        Levanta HTTPError para respostas com status de erro e URLError para
+        falhas de conexão, como o urllib2.urlopen.
+
+        timeout, em segundos, pode ser um número ou uma tupla
+        (connect_timeout, read_timeout).
+        """
+        scheme, netloc, path, query, fragment = urlsplit(url)
+        if query:
+            path += '?' + query
+        key = (scheme, netloc)
+
+        if self.compress:
+            headers = dict(headers or {})
+            headers.setdefault('Accept-Encoding', 'gzip, deflate')
+
+        conn = self._get(key)
+        reused = conn is not None
+        if conn is None:
+            conn = self._new_conn(scheme, netloc)
+
+        try:
+            start = time.time()
+            self._connect(conn, timeout)
+            connected = time.time()
+            conn.request('GET', path or '/', headers=headers or {})
+            resp = conn.getresponse()
+        except socket.timeout, e:
+            conn.close()
+            raise URLError(e)
+        except (httplib.HTTPException, socket.error), e:
+            conn.close()
+            if reused:
+                # O servidor pode ter fechado a conexão keep-alive enquanto
+                # ela estava ociosa; tenta novamente.
+                return self.urlopen(url, headers, timeout)
+            raise URLError(e)
+
+        response = PooledResponse(self, key, conn, resp)
+        response.connect_time = connected - start
+        response.ttfb = time.time() - connected
+        if response.code >= 400:
+            data = response.read()
+            raise HTTPError(url, response.code, response.msg,
+                            response.headers, StringIO(data))
+
+        return response
+
+
+class _Background(threading.Thread):
+    """
+    Executa func(*args) em uma thread; get() aguarda e devolve o resultado
+    (ou levanta a exceção ocorrida).
+    """
+
+    def __init__(self, func, *args):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.func = func
+        self.args = args
+        self.result = None
+        self.error = None
+        self.start()
+
+    def run(self):
+        try:
+            self.result = self.func(*self.args)
+        except Exception:
+            self.error = sys.exc_info()
+
+    def get(self):
+        self.join()
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+        return self.result
+
+
+class SingleFlight(object):
+    """
+    Agrupa chamadas simultâneas com a mesma chave: enquanto uma chamada
+    está em andamento, as demais com a mesma chave aguardam e recebem o
+    mesmo resultado (ou a mesma exceção), sem repetir o trabalho.
+
+    Com follower, as chamadas que aguardam executam follower(wait), em
+    que wait() aguarda e devolve o resultado (para instrumentar a espera).
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        follower = kwargs.pop('follower', None)
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = {'event': threading.Event()}
+                self.calls += 1
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+
+        if not leader:
+            def wait():
+                call['event'].wait()
+                if 'error' in call:
+                    error = call['error']
+                    raise error[0], error[1], error[2]
+                return call['result']
+
+            if follower is not None:
+                return follower(wait)
+            return wait()
+
+        try:
+            call['result'] = func(*args)
+        except Exception:
+            call['error'] = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['event'].set()
+
+        return call['result']
+
+    def stats(self):
+        return dict(calls=self.calls, shared=self.shared)
+
+
+class TruncatedResultsWarning(UserWarning):
+    """
+    Emitido pelos iteradores quando a API informa mais páginas que
+    MAX_PAGE: as páginas seguintes não podem ser pedidas, e os seus itens
+    ficam de fora.
+    """
+
+
+def _warn_truncated(tag, total_pages):
+    if total_pages is not None and total_pages > MAX_PAGE:
+        warnings.warn('results truncated: {0} pages of {1} available, only '
+                      'the first {2} can be requested'.format(
+                          total_pages, tag, MAX_PAGE),
+                      TruncatedResultsWarning, stacklevel=3)
+
+
+class _CountingReader(object):
+    """
+    Conta os bytes lidos de uma resposta (size das páginas em stream).
+    """
+
+    def __init__(self, resp):
+        self.resp = resp
+        self.size = 0
+
+    def read(self, amt=None):
+        data = self.resp.read() if amt is None else self.resp.read(amt)
+        self.size += len(data)
+        return data
+
+
+class RequestEvent(object):
+    """
+    Dados de uma requisição, entregues aos hooks (ver Buscape.add_hook).
+
+    timings traz, em segundos, as etapas medidas: validate (validação dos
+    parâmetros), build (montagem da URL), connect, ttfb (envio até o
+    primeiro byte da resposta), read (leitura do corpo) e parse. cache é
+    'hit', 'stale' ou 'miss' (None sem cache), 'revalidate' na
+    atualização em segundo plano de uma resposta stale ou 'coalesced' nas
+    chamadas que aguardaram a mesma requisição de outra (ver coalesce).
+
+    Nas páginas em stream (iter_* com stream=True) o corpo é lido e
+    interpretado à medida que os itens são consumidos: não há read nem
+    parse, e duration vai até o fim da página.
+    """
+
+    def __init__(self, method, url, started=None):
+        self.method = method.split('/')[0]
+        self.url = url
+        self.started = started or time.time()
+        self.finished = None
+        self.status = None
+        self.size = None
+        self.cache = None
+        self.attempts = 0
+        self.error = None
+        self.timings = {}
+
+    @property
+    def duration(self):
+        return (self.finished or time.time()) - self.started
+
+
+def _timed(func):
+    """
+    Marca o início da chamada de um método público, para medir o tempo de
+    validação dos parâmetros.
+    """
+    @wraps(func)
+    def call(self, *args, **kwargs):
+        self._local.started = time.time()
+        return func(self, *args, **kwargs)
+
+    return call
+
+
+class Buscape(object):
     """
     Class for BuscaPé's API abstraction
     """
 
-    def __init__(self, applicationID=None, country="BR"):
+    def __init__(self, applicationID=None, country="BR", pool_size=10,
+                 pool_idle_timeout=60, pool=None, cache=None,
+                 cache_ttls=None, stale_ttls=None, models=False,
+                 rate_limiter=None, timeout=None, retry=None, coalesce=False,
+                 compress=True, host=None, parse_processes=None):
         if not applicationID:
             raise ValueError("User ID must be specified")
 
@@ -32,30 +506,697 @@ class Buscape():
         self.environment = 'bws'
         self.format = 'xml'
         self.clientIp = None
+        self.frozen = False
+        # Opções por requisição definidas com request_options, por thread
+        self._local = threading.local()
 
         if country not in COUNTRIES:
             raise ValueError('country not in valid countries: {0}'
                              ''.format(', '.join(COUNTRIES)))
         self.country = country
 
-    def __fetch_url(self, url=None):
-        resp = urlopen(url)
+        # host substitui bws.buscape.com/sandbox.buscape.com, por exemplo
+        # para usar um servidor local em testes e benchmarks
+        self.host = host
+
+        if pool is None:
+            pool = ConnectionPool(maxsize=pool_size,
+                                  idle_timeout=pool_idle_timeout,
+                                  compress=compress)
+        self.pool = pool
+
+        # cache pode ser qualquer objeto com get(key) e set(key, value, ttl),
+        # como o LRUCache; com stale_ttls ele precisa ter também
+        # get_entry(key)
+        self.cache = cache
+        self.cache_ttls = dict(CACHE_TTLS)
+        if cache_ttls:
+            self.cache_ttls.update(cache_ttls)
+
+        # stale-while-revalidate: por quanto tempo, depois de expirado o
+        # TTL, uma resposta ainda pode ser servida enquanto é atualizada em
+        # segundo plano (requer um cache com get_entry)
+        if stale_ttls and cache is not None and \
+                not hasattr(cache, 'get_entry'):
+            raise ValueError('stale_ttls requires a cache with get_entry')
+        self.stale_ttls = dict(stale_ttls or {})
+        self._revalidating = set()
+        self._revalidate_lock = threading.Lock()
+
+        # Com models os métodos retornam um Result com objetos Offer,
+        # Product, Seller, Category e UserRating em vez do dict com a
+        # resposta bruta
+        self.models = models
+
+        # RateLimiter (pode ser compartilhado entre clientes); as
+        # requisições aguardam a vez em vez de falhar
+        self.rate_limiter = rate_limiter
+
+        # timeout: segundos, ou (connect_timeout, read_timeout)
+        # retry: RetryPolicy com as novas tentativas e o deadline
+        self.timeout = timeout
+        self.retry = retry
+
+        # Com coalesce, chamadas simultâneas para a mesma URL compartilham
+        # uma única requisição e um único resultado
+        self.single_flight = SingleFlight() if coalesce else None
+
+        self.hooks = dict((name, []) for name in HOOKS)
+
+        # parse_processes: número de processos (ou um multiprocessing.Pool)
+        # que interpretam as respostas, para que a interpretação não dispute
+        # o GIL com as threads que fazem as requisições
+        if isinstance(parse_processes, (int, long)):
+            if parse_processes < 1:
+                raise ValueError('parse_processes must be a positive integer')
+            parse_processes = multiprocessing.Pool(parse_processes)
+        self.parse_pool = parse_processes
+
+    def close(self):
+        """
+        Encerra os processos de parse_processes.
+        """
+        if self.parse_pool is not None:
+            self.parse_pool.close()
+            self.parse_pool.join()
+            self.parse_pool = None
+
+    def __parse(self, func, *args):
+        if self.parse_pool is None:
+            return func(*args)
+        # Só os bytes da resposta vão para o processo, e voltam os itens
+        return self.parse_pool.apply(func, args)
+
+    def __timeout(self, deadline):
+        timeout = self._option('timeout')
+        if deadline is None:
+            return timeout
+
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise URLError(socket.timeout('deadline exceeded'))
+
+        if timeout is None:
+            return remaining
+        if isinstance(timeout, tuple):
+            return tuple(remaining if t is None else min(t, remaining)
+                         for t in timeout)
+        return min(timeout, remaining)
+
+    def __retrying(self, func, *args):
+        policy = self.retry
+        deadline = policy.start() if policy is not None else None
+
+        attempt = 0
+        while True:
+            try:
+                return func(deadline, *args)
+            except URLError, e:
+                if policy is None:
+                    raise
+                delay = policy.next_delay(e, attempt, deadline)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+    def __open_url(self, deadline, method, url, event=None):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(self.applicationID,
+                                      method.split('/')[0])
+        if event is not None:
+            event.attempts += 1
+        return self.pool.urlopen(url, timeout=self.__timeout(deadline))
+
+    def __read_url(self, deadline, method, url, event=None):
+        if event is None:
+            resp = self.__open_url(deadline, method, url)
+            data = resp.read()
+            return dict(code=resp.code, data=data, url=url)
+
+        resp = self.__open_url(deadline, method, url, event)
+        start = time.time()
         data = resp.read()
 
+        event.timings['connect'] = getattr(resp, 'connect_time', None)
+        event.timings['ttfb'] = getattr(resp, 'ttfb', None)
+        event.timings['read'] = time.time() - start
+        event.status = resp.code
+        event.size = len(data)
+
         return dict(code=resp.code, data=data, url=url)
 
-    def __search(self, method=None, parameter=None):
-        if self.environment != 'sandbox':
-            self.environment = 'bws'
+    def __fetch_url(self, url=None, method=None, event=None):
+        return self.__retrying(self.__read_url, method, url, event)
 
-        if self.clientIp:
-            parameter += '&' + urlencode({'clientIp': self.clientIp})
+    def add_hook(self, name, callback):
+        """
+        Registra callback(event) para um dos eventos de HOOKS:
+        before_request, after_response ou on_error. event é um
+        RequestEvent com o método, a URL, o status, o tamanho da resposta,
+        o uso do cache e o tempo de cada etapa.
+        """
+        if name not in self.hooks:
+            raise ValueError('hook must be one of: {0}'
+                             ''.format(', '.join(HOOKS)))
+        self.hooks[name].append(callback)
+
+    def remove_hook(self, name, callback):
+        self.hooks[name].remove(callback)
 
-        req = "http://%s.buscape.com/service/%s/%s/%s/?%s" %\
-              (self.environment, method, self.applicationID, self.country,
-               parameter)
+    def __has_hooks(self):
+        for callbacks in self.hooks.itervalues():
+            if callbacks:
+                return True
+        return False
 
-        return self.__fetch_url(url=req)
+    def __emit(self, name, event):
+        for callback in self.hooks[name]:
+            callback(event)
+
+    def __instrumented(self, event, func, *args):
+        """
+        Executa func(*args, event=event) disparando os hooks.
+        """
+        if event is None:
+            return func(*args)
+
+        self.__emit('before_request', event)
+        try:
+            result = func(*args, event=event)
+        except Exception, e:
+            self.__finish(event, e)
+            raise
+
+        self.__finish(event)
+        return result
+
+    def __finish(self, event, error=None):
+        """
+        Encerra event, disparando after_response ou, com error, on_error.
+        """
+        event.finished = time.time()
+        if error is None:
+            self.__emit('after_response', event)
+            return
+
+        event.error = error
+        if isinstance(error, HTTPError):
+            event.status = error.code
+        self.__emit('on_error', event)
+
+    def _option(self, name):
+        """
+        Valor de clientIp, format, environment, country ou timeout para a
+        requisição atual: o definido em request_options nesta thread ou o
+        padrão do cliente.
+        """
+        options = getattr(self._local, 'options', None)
+        if options and options.get(name) is not None:
+            return options[name]
+        return getattr(self, name)
+
+    def _bind_options(self, func):
+        """
+        Retorna func executando com as opções de request_options da thread
+        atual, para uso em outras threads (prefetch, lotes).
+        """
+        options = getattr(self._local, 'options', None)
+
+        def call(*args, **kwargs):
+            previous = getattr(self._local, 'options', None)
+            self._local.options = options
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._local.options = previous
+
+        return call
+
+    @contextmanager
+    def request_options(self, clientIp=None, format=None, environment=None,
+                        country=None, timeout=None):
+        """
+        Define clientIp, format, environment ('bws' ou 'sandbox'), country
+        e/ou timeout só para as requisições feitas dentro do bloco with, na
+        thread atual, sem alterar o cliente. Permite compartilhar uma mesma
+        instância (e o seu pool de conexões) entre threads.
+        """
+        if clientIp is not None:
+            socket.inet_aton(clientIp)  # Valida Ip
+        if format is not None:
+            format = self.__default_filter(format=format)['format']
+        if environment is not None and environment not in ('bws', 'sandbox'):
+            raise ValueError('environment must be bws or sandbox')
+        if country is not None and country not in COUNTRIES:
+            raise ValueError('country not in valid countries: {0}'
+                             ''.format(', '.join(COUNTRIES)))
+
+        previous = getattr(self._local, 'options', None)
+        options = dict(previous or {})
+        for name, value in (('clientIp', clientIp), ('format', format),
+                            ('environment', environment),
+                            ('country', country), ('timeout', timeout)):
+            if value is not None:
+                options[name] = value
+
+        self._local.options = options
+        try:
+            yield self
+        finally:
+            self._local.options = previous
+
+    def freeze(self):
+        """
+        Impede alterações nas opções padrão do cliente (set_sandbox,
+        set_default_format, set_clientIp, unset_clientIp). Opções por
+        requisição devem ser passadas com request_options.
+        """
+        self.frozen = True
+
+    def __check_frozen(self):
+        if self.frozen:
+            raise RuntimeError('client is frozen; use request_options '
+                               'instead')
+
+    def __build_url(self, method=None, parameter=None):
+        environment = self._option('environment')
+        if environment != 'sandbox':
+            environment = 'bws'
+
+        clientIp = self._option('clientIp')
+        if clientIp:
+            parameter += '&' + urlencode({'clientIp': clientIp})
+
+        host = self.host or '%s.buscape.com' % environment
+
+        return "http://%s/service/%s/%s/%s/?%s" %\
+               (host, method, self.applicationID, self._option('country'),
+                parameter)
+
+    def __search(self, method=None, parameter=None, projection=None):
+        if not self.__has_hooks():
+            req = self.__build_url(method=method, parameter=parameter)
+            return self._execute(method, req, projection)
+
+        start = time.time()
+        started = getattr(self._local, 'started', None) or start
+        self._local.started = None
+        req = self.__build_url(method=method, parameter=parameter)
+
+        event = RequestEvent(method, req, started)
+        event.timings['validate'] = start - started
+        event.timings['build'] = time.time() - start
+
+        return self._execute(method, req, projection, event)
+
+    def __projection(self, tag, fields):
+        if fields is None:
+            return None
+        return projection(MODELS[tag], fields)
+
+    def __fetch_page(self, build, tag, page, kwargs, projection=None):
+        start = time.time()
+        method, params = build(page=page, **kwargs)
+        url = self.__build_url(method=method, parameter=urlencode(params))
+
+        event = None
+        if self.__has_hooks():
+            event = RequestEvent(method, url, start)
+
+        return self.__instrumented(event, self.__parse_page, method, url,
+                                   params['format'], tag, projection)
+
+    def __parse_page(self, method, url, format, tag, projection, event=None):
+        resp = self._fetch(method, url, event)
+        if event is None:
+            return self.__parse(parse_page, resp['data'], format, tag,
+                                self.models, projection)
+
+        start = time.time()
+        page = self.__parse(parse_page, resp['data'], format, tag,
+                            self.models, projection)
+        event.timings['parse'] = time.time() - start
+        return page
+
+    def __open_page(self, build, tag, page, kwargs, projection=None):
+        start = time.time()
+        method, params = build(page=page, **kwargs)
+        url = self.__build_url(method=method, parameter=urlencode(params))
+
+        # Só a abertura da resposta é repetida em caso de falha
+        if not self.__has_hooks():
+            resp = self.__retrying(self.__open_url, method, url)
+            return resp, StreamParser(resp, tag, self.models, projection), None
+
+        # O evento é encerrado por __iter_stream_pages, no fim da página
+        event = RequestEvent(method, url, start)
+        self.__emit('before_request', event)
+        try:
+            resp = self.__retrying(self.__open_url, method, url, event)
+        except Exception, e:
+            self.__finish(event, e)
+            raise
+
+        event.status = resp.code
+        event.timings['connect'] = getattr(resp, 'connect_time', None)
+        event.timings['ttfb'] = getattr(resp, 'ttfb', None)
+        stream = _CountingReader(resp)
+        return resp, StreamParser(stream, tag, self.models, projection), event
+
+    def __iter_stream_pages(self, open_page, build, tag, page, kwargs):
+        while True:
+            resp, items, event = open_page(build, tag, page, kwargs)
+
+            count = 0
+            error = None
+            try:
+                for item in items:
+                    count += 1
+                    yield item
+            except Exception, e:
+                error = e
+                raise
+            finally:
+                # Se a iteração foi interrompida a conexão é descartada
+                resp.close()
+                if event is not None:
+                    event.size = items.stream.size
+                    self.__finish(event, error)
+
+            if items.total_pages is None:
+                has_next = bool(count)
+            else:
+                has_next = page < min(items.total_pages, MAX_PAGE)
+
+            if not has_next:
+                _warn_truncated(tag, items.total_pages)
+                return
+            page += 1
+
+    def __iter_pages(self, build, tag, page, prefetch, kwargs, stream=False,
+                     fields=None):
+        projection = self.__projection(tag, fields)
+
+        # As opções de request_options valem para a iteração inteira, mesmo
+        # que ela seja consumida fora do bloco with
+        if stream:
+            format = kwargs['format'] or 'xml'
+            if format.lower() != 'xml':
+                raise ValueError('stream is only supported for the xml '
+                                 'format')
+            kwargs['format'] = 'xml'
+            return self.__iter_stream_pages(
+                self._bind_options(partial(self.__open_page,
+                                           projection=projection)),
+                build, tag, page, kwargs)
+
+        kwargs['format'] = kwargs['format'] or self._option('format')
+        return self.__iter_buffered_pages(
+            self._bind_options(partial(self.__fetch_page,
+                                       projection=projection)),
+            build, tag, page, prefetch, kwargs)
+
+    def __iter_buffered_pages(self, fetch, build, tag, page, prefetch,
+                              kwargs):
+        pending = None
+        while True:
+            if pending is None:
+                current, total_pages, items = fetch(build, tag, page, kwargs)
+            else:
+                current, total_pages, items = pending.get()
+                pending = None
+
+            if total_pages is None:
+                has_next = bool(items)
+            else:
+                has_next = page < min(total_pages, MAX_PAGE)
+
+            if has_next:
+                page += 1
+                if prefetch:
+                    pending = _Background(fetch, build, tag, page, kwargs)
+
+            for item in items:
+                yield item
+
+            if not has_next:
+                _warn_truncated(tag, total_pages)
+                return
+
+    def __many(self, build, ids, format, concurrency):
+        if not isinstance(concurrency, int) or concurrency < 1:
+            raise ValueError('concurrency must be a positive integer')
+
+        ids = list(ids)
+        unique = []
+        index = {}
+        for id in ids:
+            if id not in index:
+                index[id] = len(unique)
+                unique.append(id)
+
+        def run(id):
+            try:
+                start = time.time()
+                method, params = build(id, format)
+                url = self.__build_url(method=method,
+                                       parameter=urlencode(params))
+                event = None
+                if self.__has_hooks():
+                    event = RequestEvent(method, url, start)
+                # Sempre síncrono, mesmo no AsyncBuscape
+                return Buscape._execute(self, method, url, None, event), None
+            except Exception, e:
+                return None, e
+
+        if not unique:
+            return []
+
+        workers = ThreadPool(min(concurrency, len(unique)))
+        try:
+            outcomes = workers.map(self._bind_options(run), unique, 1)
+        finally:
+            workers.close()
+            workers.join()
+
+        results = []
+        for id in ids:
+            result, error = outcomes[index[id]]
+            results.append(dict(id=id, result=result, error=error))
+        return results
+
+    def search_countries(self, method, countries=None, timeout=None,
+                         **kwargs):
+        """
+        Executa method ('find_product_list', 'find_offer_list' ou
+        'top_products', com os parâmetros kwargs) em vários países ao mesmo
+        tempo (por padrão, todos os de COUNTRIES), compartilhando o pool de
+        conexões do cliente.
+
+        timeout (segundos, ou um dict {país: segundos}) limita a espera por
+        cada país: um país lento não atrasa os demais, e a sua requisição é
+        feita com esse timeout.
+
+        Retorna uma lista, na ordem de countries, de dicts com country,
+        result e error. Os erros de validação dos parâmetros são levantados
+        antes de qualquer requisição.
+        """
+        if method not in COUNTRY_METHODS:
+            raise ValueError('method must be one of: {0}'
+                             ''.format(', '.join(COUNTRY_METHODS)))
+        countries = list(countries or COUNTRIES)
+        for country in countries:
+            if country not in COUNTRIES:
+                raise ValueError('country not in valid countries: {0}'
+                                 ''.format(', '.join(COUNTRIES)))
+        if not countries:
+            return []
+
+        # Os parâmetros são validados aqui, uma única vez: nas threads
+        # qualquer exceção (inclusive ValueError de uma resposta inválida)
+        # é o erro do país
+        validate, tag = {
+            'find_product_list': (self.__product_list_params, 'product'),
+            'find_offer_list': (self.__offer_list_params, 'offer'),
+            'top_products': (self.__top_products_params, 'product'),
+        }[method]
+        params = dict(kwargs)
+        self.__projection(tag, params.pop('fields', None))
+        validate(**params)
+
+        def limit(country):
+            if isinstance(timeout, dict):
+                return timeout.get(country)
+            return timeout
+
+        func = getattr(self, method)
+
+        def run(country):
+            try:
+                with self.request_options(country=country,
+                                          timeout=limit(country)):
+                    result = func(**kwargs)
+                return self._wait(result), None
+            except Exception, e:
+                return None, e
+
+        start = time.time()
+        workers = ThreadPool(len(countries))
+        try:
+            pending = [workers.apply_async(self._bind_options(run), (country,))
+                       for country in countries]
+        finally:
+            # Sem join: as requisições que passarem do timeout terminam em
+            # segundo plano
+            workers.close()
+
+        results = []
+        for country, outcome in zip(countries, pending):
+            seconds = limit(country)
+            try:
+                if seconds is None:
+                    result, error = outcome.get()
+                else:
+                    result, error = outcome.get(
+                        max(0, start + seconds - time.time()))
+            except multiprocessing.TimeoutError:
+                result, error = None, multiprocessing.TimeoutError(
+                    'no response from {0} within {1}s'.format(country,
+                                                              seconds))
+            results.append(dict(country=country, result=result,
+                                error=error))
+        return results
+
+    def _wait(self, result):
+        """
+        Resultado de uma chamada a um método público: no Buscape é o
+        próprio retorno; o AsyncBuscape aguarda o AsyncResult.
+        """
+        return result
+
+    def _execute(self, method, url, projection=None, event=None):
+        """
+        Executa a requisição já montada. Subclasses podem sobrescrever
+        para mudar como a requisição é despachada (ver AsyncBuscape).
+        """
+        if self.single_flight is None:
+            return self.__instrumented(event, self.__fetch_result, method,
+                                       url, projection)
+
+        follower = None
+        if event is not None:
+            def follower(wait):
+                # Quem aguarda a requisição de outra chamada tem o seu
+                # próprio evento, com cache 'coalesced'
+                event.cache = 'coalesced'
+                return self.__instrumented(event, self.__follow, wait)
+
+        key = url if projection is None else (url, projection.names)
+        result = self.single_flight.do(key, self.__instrumented, event,
+                                       self.__fetch_result, method, url,
+                                       projection, follower=follower)
+        if isinstance(result, dict):
+            # Cada chamador recebe a sua cópia da resposta bruta
+            return dict(result)
+        return result
+
+    def __follow(self, wait, event=None):
+        result = wait()
+        if event is not None:
+            event.status = (result['code'] if isinstance(result, dict)
+                            else result.code)
+        return result
+
+    def __fetch_result(self, method, url, projection=None, event=None):
+        resp = self._fetch(method, url, event)
+        if not self.models and projection is None:
+            return resp
+
+        start = time.time()
+        result = self.__parse(parse_result, resp, None, None, projection)
+        if event is not None:
+            event.timings['parse'] = time.time() - start
+
+        # A resposta bruta não passa pelos processos de parse_processes
+        if method.split('/')[0] in RAW_DATA_METHODS:
+            result.data = resp['data']
+        return result
+
+    def _fetch(self, method, url, event=None):
+        """
+        Busca a resposta bruta, passando pelo cache.
+        """
+        ttl = self._cache_ttl(method)
+        stale = self._stale_ttl(method) if ttl else 0
+
+        if stale:
+            entry = self.cache.get_entry(url)
+            if entry is not None:
+                cached, expires = entry
+                # A entrada é gravada com ttl + stale; passado o ttl ela
+                # ainda é servida, mas é atualizada em segundo plano
+                if expires - stale <= time.time():
+                    self.__revalidate(method, url, ttl + stale)
+                    self.__cache_event(event, 'stale', cached)
+                else:
+                    self.__cache_event(event, 'hit', cached)
+                return dict(cached)
+        elif ttl:
+            cached = self.cache.get(url)
+            if cached is not None:
+                self.__cache_event(event, 'hit', cached)
+                return dict(cached)
+
+        if ttl and event is not None:
+            event.cache = 'miss'
+
+        resp = self.__fetch_url(url=url, method=method, event=event)
+
+        if ttl:
+            self.cache.set(url, resp, ttl + stale)
+            return dict(resp)
+
+        return resp
+
+    def __cache_event(self, event, cache, resp):
+        if event is not None:
+            event.cache = cache
+            event.status = resp['code']
+            event.size = len(resp['data'])
+
+    def __revalidate(self, method, url, ttl):
+        with self._revalidate_lock:
+            if url in self._revalidating:
+                return
+            self._revalidating.add(url)
+
+        event = None
+        if self.__has_hooks():
+            event = RequestEvent(method, url)
+            event.cache = 'revalidate'
+
+        def refresh():
+            try:
+                resp = self.__instrumented(event, self.__fetch_url, url,
+                                           method)
+                self.cache.set(url, resp, ttl)
+            finally:
+                with self._revalidate_lock:
+                    self._revalidating.discard(url)
+
+        # Erros são ignorados: a entrada antiga continua valendo até
+        # expirar de vez
+        _Background(self._bind_options(refresh))
+
+    def _cache_ttl(self, method):
+        if self.cache is None:
+            return 0
+        # findOfferList/lomadee usa o mesmo TTL de findOfferList
+        return self.cache_ttls.get(method.split('/')[0], 0)
+
+    def _stale_ttl(self, method):
+        return self.stale_ttls.get(method.split('/')[0], 0)
 
     def __default_filter(self, format=None, results=10, page=1, priceMin=None,
                          priceMax=None, sort=None, medal=None):
@@ -69,7 +1210,7 @@ class Buscape():
             if format.upper() not in ["XML", "JSON"]:
                 raise ValueError("the return format must be XML or JSON")
         else:
-            format = self.format
+            format = self._option('format')
         # Formato precisa ser em lower case
         format = format.lower()
 
@@ -148,19 +1289,24 @@ class Buscape():
         """
         Define the environment test
         """
+        self.__check_frozen()
         self.environment = 'sandbox'
 
     def set_default_format(self, format):
+        self.__check_frozen()
         self.__default_filter(format=format)
         self.format = format
 
     def set_clientIp(self, ip):
+        self.__check_frozen()
         socket.inet_aton(ip)  # Valida Ip
         self.clientIp = ip
 
     def unset_clientIp(self):
+        self.__check_frozen()
         self.clientIp = None
 
+    @_timed
     def find_category_list(self, keyword=None, categoryID=None, format=None):
         """
         Método faz busca de categorias, permite que você exiba informações
@@ -186,14 +1332,32 @@ class Buscape():
 
         return self.__search(method='findCategoryList', parameter=parameter)
 
+    @_timed
     def find_product_list(self, keyword=None, categoryID=None, format=None,
                           lomadee=False, results=10, page=1, minPrice=None,
-                          maxPrice=None, sort=None, medal=None):
+                          maxPrice=None, sort=None, medal=None, fields=None):
         """
         Método permite que você busque uma lista de produtos únicos
         utilizando o id da categoria final ou um conjunto de palavras-chaves
         ou ambos.
+
+        Com fields (ex.: ('id', 'price_min')) o retorno é um Result cujos
+        itens são records só com esses atributos de Product.
         """
+        method, params = self.__product_list_params(
+            keyword, categoryID, format, lomadee, results, page, minPrice,
+            maxPrice, sort, medal)
+        projection = self.__projection('product', fields)
+
+        parameter = urlencode(params)
+
+        return self.__search(method=method, parameter=parameter,
+                             projection=projection)
+
+    def __product_list_params(self, keyword=None, categoryID=None,
+                              format=None, lomadee=False, results=10, page=1,
+                              minPrice=None, maxPrice=None, sort=None,
+                              medal=None):
         if keyword is None and categoryID is None:
             raise ValueError("keyword or categoryID option must be specified")
 
@@ -211,10 +1375,32 @@ class Buscape():
         else:
             method = "findProductList"
 
-        parameter = urlencode(params)
+        return method, params
 
-        return self.__search(method=method, parameter=parameter)
+    def iter_products(self, keyword=None, categoryID=None, format=None,
+                      lomadee=False, results=100, page=1, minPrice=None,
+                      maxPrice=None, sort=None, medal=None, prefetch=True,
+                      stream=False, fields=None):
+        """
+        Percorre todas as páginas de find_product_list a partir de page,
+        devolvendo os produtos um a um. Com prefetch a próxima página é
+        buscada em segundo plano enquanto a atual é consumida. Com fields
+        os produtos são records só com esses atributos.
+
+        Com stream (somente XML) cada página é interpretada enquanto é
+        recebida, sem guardar a resposta inteira em memória; nesse modo não
+        há prefetch nem cache.
+        """
+        kwargs = dict(keyword=keyword, categoryID=categoryID, format=format,
+                      lomadee=lomadee, results=results, minPrice=minPrice,
+                      maxPrice=maxPrice, sort=sort, medal=medal)
+        # Valida os parâmetros antes de começar a iteração
+        self.__product_list_params(page=page, **kwargs)
+
+        return self.__iter_pages(self.__product_list_params, 'product', page,
+                                 prefetch, kwargs, stream, fields)
 
+    @_timed
     def create_source_id(self, sourceName=None, publisherID=None, siteID=None,
                          campaignList=None, token=None, format=None):
         """
@@ -259,15 +1445,34 @@ class Buscape():
         return self.__search(method='createSource/lomadee', parameter=parameter)
 
 
+    @_timed
     def find_offer_list(self, categoryID=None, productID=None, barcode=None,
                         keyword=None, lomadee=False, format=None,
                         results=10, page=1, priceMin=None, priceMax=None,
-                        sort=None, medal=None):
+                        sort=None, medal=None, fields=None):
         """
         Método permite que você busque uma lista de produtos únicos
         utilizando o id da categoria final ou um conjunto de palavras-chaves
         ou ambos.
+
+        Com fields (ex.: ('id', 'price', 'seller_id', 'product_id')) o
+        retorno é um Result cujos itens são records só com esses atributos
+        de Offer; os demais campos das ofertas não são interpretados.
         """
+        method, params = self.__offer_list_params(
+            categoryID, productID, barcode, keyword, lomadee, format, results,
+            page, priceMin, priceMax, sort, medal)
+        projection = self.__projection('offer', fields)
+
+        parameter = urlencode(params)
+
+        return self.__search(method=method, parameter=parameter,
+                             projection=projection)
+
+    def __offer_list_params(self, categoryID=None, productID=None,
+                            barcode=None, keyword=None, lomadee=False,
+                            format=None, results=10, page=1, priceMin=None,
+                            priceMax=None, sort=None, medal=None):
         self._validate_categoryID(categoryID)
         params = self.__default_filter(format, results, page, priceMin,
                                        priceMax, sort, medal)
@@ -290,30 +1495,95 @@ class Buscape():
         else:
             raise ValueError("One parameter must be especified")
 
-        parameter = urlencode(params)
+        return method, params
 
-        return self.__search(method=method, parameter=parameter)
+    def iter_offers(self, categoryID=None, productID=None, barcode=None,
+                    keyword=None, lomadee=False, format=None, results=100,
+                    page=1, priceMin=None, priceMax=None, sort=None,
+                    medal=None, prefetch=True, stream=False, fields=None):
+        """
+        Percorre todas as páginas de find_offer_list a partir de page,
+        devolvendo as ofertas uma a uma. Com prefetch a próxima página é
+        buscada em segundo plano enquanto a atual é consumida. Com fields
+        as ofertas são records só com esses atributos.
+
+        Com stream (somente XML) cada página é interpretada enquanto é
+        recebida, sem guardar a resposta inteira em memória; nesse modo não
+        há prefetch nem cache.
+        """
+        kwargs = dict(categoryID=categoryID, productID=productID,
+                      barcode=barcode, keyword=keyword, lomadee=lomadee,
+                      format=format, results=results, priceMin=priceMin,
+                      priceMax=priceMax, sort=sort, medal=medal)
+        self.__offer_list_params(page=page, **kwargs)
 
+        return self.__iter_pages(self.__offer_list_params, 'offer', page,
+                                 prefetch, kwargs, stream, fields)
 
+    def offer_columns(self, fields=OFFER_FIELDS, **kwargs):
+        """
+        Carrega todas as ofertas de iter_offers (que recebe os demais
+        parâmetros) em um Columns, com os preços e ids em arrays, para
+        calcular estatísticas sobre grandes volumes (ex.: stats() com o
+        preço mínimo, mediano e máximo de cada produto).
+        """
+        columns = Columns(fields)
+        columns.extend(self.iter_offers(fields=fields, **kwargs))
+        return columns
+
+
+    @_timed
     def top_products(self, format=None, results=10, page=1, priceMin=None,
-                     priceMax=None, sort=None, medal=None):
+                     priceMax=None, sort=None, medal=None, fields=None):
 
         """
-        Método que retorna os produtos mais populares do BuscaPé.
+        Método que retorna os produtos mais populares do BuscaPé. fields
+        funciona como em find_product_list.
         """
 
+        method, params = self.__top_products_params(
+            format, results, page, priceMin, priceMax, sort, medal)
+        projection = self.__projection('product', fields)
+
+        parameter = urlencode(params)
+
+        return self.__search(method=method, parameter=parameter,
+                             projection=projection)
+
+    def __top_products_params(self, format=None, results=10, page=1,
+                              priceMin=None, priceMax=None, sort=None,
+                              medal=None):
         params = self.__default_filter(format, results, page, priceMin,
                                        priceMax, sort, medal)
         method = "topProducts"
 
-        parameter = urlencode(params)
+        return method, params
 
-        return self.__search(method=method, parameter=parameter)
+    def iter_top_products(self, format=None, results=100, page=1,
+                          priceMin=None, priceMax=None, sort=None, medal=None,
+                          prefetch=True, stream=False, fields=None):
+        """
+        Percorre todas as páginas de top_products a partir de page,
+        devolvendo os produtos um a um (ver iter_products).
+        """
+        kwargs = dict(format=format, results=results, priceMin=priceMin,
+                      priceMax=priceMax, sort=sort, medal=medal)
+        self.__top_products_params(page=page, **kwargs)
 
+        return self.__iter_pages(self.__top_products_params, 'product', page,
+                                 prefetch, kwargs, stream, fields)
+
+    @_timed
     def view_product_details(self, productID=None, format=None):
         """
         Método retorna os detalhes técnicos de um determinado produto.
         """
+        method, params = self.__product_details_params(productID, format)
+        parameter = urlencode(params)
+
+        return self.__search(method=method, parameter=parameter)
+
+    def __product_details_params(self, productID=None, format=None):
         if not productID:
             raise ValueError('productID option must be specified')
 
@@ -321,15 +1591,35 @@ class Buscape():
 
         params = self.__default_filter(format=format)
         params['productId'] = productID
-        parameter = urlencode(params)
 
-        return self.__search(method=method, parameter=parameter)
+        return method, params
+
+    def view_product_details_many(self, productIDs, format=None,
+                                  concurrency=8):
+        """
+        Detalhes de vários produtos (ver view_product_details). IDs
+        repetidos geram uma única requisição e até concurrency requisições
+        são feitas ao mesmo tempo.
+
+        Retorna uma lista, na ordem de productIDs, de dicts com id, result
+        (a resposta de view_product_details) e error (a exceção ocorrida
+        para aquele ID, ou None); um erro não interrompe os demais.
+        """
+        return self.__many(self.__product_details_params, productIDs, format,
+                           concurrency)
 
+    @_timed
     def view_seller_details(self, sellerID=None, format=None):
         """
         Método que retorna os detalhes de uma loja ou empresa como:
         endereços, telefones de contato e etc.
         """
+        method, params = self.__seller_details_params(sellerID, format)
+        parameter = urlencode(params)
+
+        return self.__search(method=method, parameter=parameter)
+
+    def __seller_details_params(self, sellerID=None, format=None):
         if not sellerID:
             raise ValueError("sellerID option must be specified")
 
@@ -340,10 +1630,18 @@ class Buscape():
 
         params = self.__default_filter(format=format)
         params['sellerId'] = sellerID
-        parameter = urlencode(params)
 
-        return self.__search(method=method, parameter=parameter)
+        return method, params
 
+    def view_seller_details_many(self, sellerIDs, format=None, concurrency=8):
+        """
+        Detalhes de várias lojas, com o mesmo comportamento de
+        view_product_details_many.
+        """
+        return self.__many(self.__seller_details_params, sellerIDs, format,
+                           concurrency)
+
+    @_timed
     def view_user_ratings(self, productID=None, format=None):
         """
         Método que retorna as avaliações dos usuários sobre um determinado
@@ -361,3 +1659,44 @@ class Buscape():
         parameter = urlencode(params)
 
         return self.__search(method=method, parameter=parameter)
+
+
+class AsyncBuscape(Buscape):
+    """
+    Versão concorrente do Buscape.
+
+    Os métodos públicos são os mesmos e validam os parâmetros no momento da
+    chamada, mas a requisição é executada em um pool de threads e o retorno
+    é um AsyncResult (multiprocessing.pool); use get() para obter o
+    resultado. max_concurrency limita quantas requisições ficam em andamento
+    ao mesmo tempo.
+    """
+
+    def __init__(self, applicationID=None, country="BR", max_concurrency=32,
+                 **kwargs):
+        if not isinstance(max_concurrency, int) or max_concurrency < 1:
+            raise ValueError('max_concurrency must be a positive integer')
+
+        kwargs.setdefault('pool_size', max_concurrency)
+        super(AsyncBuscape, self).__init__(applicationID, country, **kwargs)
+
+        self.max_concurrency = max_concurrency
+        self._workers = ThreadPool(max_concurrency)
+
+    def _execute(self, method, url, projection=None, event=None):
+        # A requisição roda em outra thread, com as opções de
+        # request_options desta (inclusive timeout)
+        return self._workers.apply_async(
+            self._bind_options(super(AsyncBuscape, self)._execute),
+            (method, url, projection, event))
+
+    def _wait(self, result):
+        return result.get()
+
+    def close(self):
+        """
+        Aguarda as requisições pendentes e encerra as threads.
+        """
+        self._workers.close()
+        self._workers.join()
+        super(AsyncBuscape, self).close()
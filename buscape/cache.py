@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+import cPickle as pickle
+import os
+import sqlite3
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Cache de respostas em memória, limitado a maxsize entradas. Cada
+    entrada tem seu próprio tempo de expiração (ttl, em segundos); quando
+    o cache está cheio a entrada usada há mais tempo é descartada.
+    """
+
+    def __init__(self, maxsize=1000):
+        if not isinstance(maxsize, int) or maxsize < 1:
+            raise ValueError('maxsize must be a positive integer')
+
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_entry(self, key):
+        """
+        Retorna (value, expires), em que expires é o time.time() em que a
+        entrada expira, ou None se não houver entrada válida.
+        """
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None or entry[1] <= time.time():
+                self.misses += 1
+                return None
+
+            # Reinsere para marcar como usada recentemente
+            self._data[key] = entry
+            self.hits += 1
+            return entry
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, time.time() + ttl)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses,
+                        size=len(self._data))
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache(object):
+    """
+    Cache de respostas persistente, em um arquivo SQLite que pode ser
+    compartilhado por vários processos (e threads) na mesma máquina.
+
+    max_entries e max_bytes limitam o tamanho do cache; quando são
+    ultrapassados as entradas mais próximas de expirar são removidas.
+    compact() remove as entradas expiradas e devolve o espaço ao sistema.
+    """
+
+    # Os limites de tamanho são verificados a cada check_every gravações
+    check_every = 100
+
+    def __init__(self, path, max_entries=None, max_bytes=None, timeout=30):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+        db = self._db()
+        db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                   'key TEXT PRIMARY KEY, value BLOB, expires REAL, '
+                   'size INTEGER)')
+        db.execute('CREATE INDEX IF NOT EXISTS responses_expires '
+                   'ON responses (expires)')
+
+    def _db(self):
+        # Uma conexão por thread e por processo (conexões SQLite não podem
+        # ser usadas depois de um fork)
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=self.timeout,
+                                 isolation_level=None)
+            db.text_factory = str
+            db.execute('PRAGMA journal_mode=WAL')
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def get_entry(self, key):
+        row = self._db().execute(
+            'SELECT value, expires FROM responses WHERE key = ?',
+            (key,)).fetchone()
+
+        with self._lock:
+            if row is None or row[1] <= time.time():
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        return pickle.loads(str(row[0])), row[1]
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def set(self, key, value, ttl):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        self._db().execute(
+            'INSERT OR REPLACE INTO responses (key, value, expires, size) '
+            'VALUES (?, ?, ?, ?)',
+            (key, sqlite3.Binary(data), time.time() + ttl, len(data)))
+
+        with self._lock:
+            self._writes += 1
+            check = self._writes % self.check_every == 0
+        if check:
+            self.enforce_limits()
+
+    def delete(self, key):
+        self._db().execute('DELETE FROM responses WHERE key = ?', (key,))
+
+    def clear(self):
+        self._db().execute('DELETE FROM responses')
+
+    def enforce_limits(self):
+        """
+        Remove as entradas expiradas e, se necessário, as mais próximas de
+        expirar até respeitar max_entries e max_bytes.
+        """
+        db = self._db()
+        db.execute('DELETE FROM responses WHERE expires <= ?', (time.time(),))
+
+        if self.max_entries is not None:
+            db.execute('DELETE FROM responses WHERE key IN ('
+                       'SELECT key FROM responses ORDER BY expires DESC '
+                       'LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+        if self.max_bytes is not None:
+            total = db.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            rows = db.execute('SELECT key, size FROM responses '
+                              'ORDER BY expires').fetchall()
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                db.execute('DELETE FROM responses WHERE key = ?', (key,))
+                total -= size
+
+    def compact(self):
+        self.enforce_limits()
+        self._db().execute('VACUUM')
+
+    def stats(self):
+        size, total = self._db().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses'
+        ).fetchone()
+        return dict(hits=self.hits, misses=self.misses, size=size,
+                    bytes=total)
+
+    def __len__(self):
+        return self._db().execute(
+            'SELECT COUNT(*) FROM responses').fetchone()[0]
+
+
+class TieredCache(object):
+    """
+    Combina caches em camadas, por exemplo um LRUCache na frente de um
+    SQLiteCache. A leitura procura da primeira para a última camada e,
+    quando encontra, copia a entrada para as camadas anteriores; a escrita
+    vai para todas.
+    """
+
+    def __init__(self, *tiers):
+        if not tiers:
+            raise ValueError('at least one cache must be specified')
+        self.tiers = tiers
+
+    def get_entry(self, key):
+        for index, tier in enumerate(self.tiers):
+            entry = tier.get_entry(key)
+            if entry is not None:
+                ttl = entry[1] - time.time()
+                if ttl > 0:
+                    for upper in self.tiers[:index]:
+                        upper.set(key, entry[0], ttl)
+                return entry
+        return None
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def set(self, key, value, ttl):
+        for tier in self.tiers:
+            tier.set(key, value, ttl)
+
+    def delete(self, key):
+        for tier in self.tiers:
+            tier.delete(key)
+
+    def clear(self):
+        for tier in self.tiers:
+            tier.clear()
+
+    def stats(self):
+        return [tier.stats() for tier in self.tiers]
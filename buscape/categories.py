@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+"""
+Índice local da árvore de categorias, montado com find_category_list.
+"""
+
+import cPickle as pickle
+import hashlib
+import os
+import re
+import threading
+import time
+import unicodedata
+
+from bisect import bisect_left
+from multiprocessing.pool import ThreadPool
+
+from models import Category
+from parser import parse_result
+
+# Versão do arquivo gravado por CategoryIndex.save
+FORMAT_VERSION = 1
+
+_WORDS = re.compile(r'\w+', re.UNICODE)
+
+
+def normalize(text):
+    """
+    Texto em minúsculas e sem acentos, para as buscas por nome.
+    """
+    if isinstance(text, str):
+        text = text.decode('utf-8')
+    text = unicodedata.normalize('NFKD', text or u'')
+    return u''.join(c for c in text if not unicodedata.combining(c)).lower()
+
+
+def _fingerprint(children):
+    listing = sorted((c.id, c.name, c.is_final, c.has_offer)
+                     for c in children)
+    return hashlib.md5(repr(listing)).digest()[:8]
+
+
+class CategoryIndex(object):
+    """
+    Cópia local da árvore de categorias do BuscaPé: crawl() percorre a
+    árvore uma vez a partir de root e, depois disso, get, parent,
+    children, ancestors, descendants, find e resolve são consultas em
+    memória, sem requisições.
+
+    O índice pode ser gravado e carregado (save/load). refresh() busca de
+    novo só as listagens mais antigas e percorre apenas as subárvores que
+    mudaram; schedule() faz isso periodicamente em segundo plano.
+
+        index = CategoryIndex(buscape)
+        index.crawl()
+        index.save('categorias.idx')
+        ...
+        index = CategoryIndex.load('categorias.idx', buscape)
+        index.resolve('celular')
+    """
+
+    def __init__(self, client=None, root=0, concurrency=4):
+        if not isinstance(concurrency, int) or concurrency < 1:
+            raise ValueError('concurrency must be a positive integer')
+
+        self.client = client
+        self.root = root
+        self.concurrency = concurrency
+        self.last_error = None
+
+        self._nodes = {}
+        self._parents = {}
+        self._children = {}
+        # Quando e com que conteúdo a listagem de cada categoria não final
+        # foi buscada, para o refresh
+        self._synced = {}
+        self._fingerprints = {}
+        self._words = []
+        self._lock = threading.RLock()
+        self._stop = None
+
+    # Consultas
+
+    def get(self, categoryID):
+        return self._nodes.get(categoryID)
+
+    def __getitem__(self, categoryID):
+        return self._nodes[categoryID]
+
+    def __contains__(self, categoryID):
+        return categoryID in self._nodes
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __iter__(self):
+        return self._nodes.itervalues()
+
+    def parent(self, categoryID):
+        parent = self._parents.get(categoryID)
+        return self._nodes.get(parent)
+
+    def children(self, categoryID):
+        return [self._nodes[id] for id in self._children.get(categoryID, ())]
+
+    def ancestors(self, categoryID):
+        """
+        Categorias de categoryID até o topo da árvore, começando pela mãe.
+        """
+        path = []
+        parent = self._parents.get(categoryID)
+        while parent in self._nodes:
+            path.append(self._nodes[parent])
+            parent = self._parents.get(parent)
+        return path
+
+    def descendants(self, categoryID):
+        found = []
+        pending = list(self._children.get(categoryID, ()))
+        while pending:
+            id = pending.pop()
+            found.append(self._nodes[id])
+            pending.extend(self._children.get(id, ()))
+        return found
+
+    def find(self, text, limit=10):
+        """
+        Categorias cujo nome tem palavras começando com cada palavra de
+        text (sem diferenciar maiúsculas e acentos). Os nomes iguais a text
+        vêm primeiro, depois os que começam com text e as categorias
+        finais.
+        """
+        query = normalize(text)
+        words = _WORDS.findall(query)
+        if not words:
+            return []
+
+        words_index = self._words
+        found = None
+        for word in words:
+            ids = set()
+            i = bisect_left(words_index, (word,))
+            while i < len(words_index) and \
+                    words_index[i][0].startswith(word):
+                ids.add(words_index[i][1])
+                i += 1
+            found = ids if found is None else found & ids
+            if not found:
+                return []
+
+        def rank(id):
+            node = self._nodes[id]
+            name = normalize(node.name)
+            return (name != query, not name.startswith(query),
+                    not node.is_final, len(name), id)
+
+        return [self._nodes[id] for id in sorted(found, key=rank)[:limit]]
+
+    def resolve(self, keyword):
+        """
+        A categoria que melhor corresponde a keyword (ver find), ou None.
+        """
+        found = self.find(keyword, limit=1)
+        return found[0] if found else None
+
+    # Sincronização
+
+    def __listing(self, categoryID):
+        result = self.client._wait(
+            self.client.find_category_list(categoryID=categoryID))
+        if isinstance(result, dict):
+            result = parse_result(result, tags=('category', 'subcategory'))
+
+        node = None
+        children = []
+        for item in result.items:
+            if not isinstance(item, Category):
+                continue
+            if item.id == categoryID:
+                node = item
+            else:
+                children.append(item)
+        return categoryID, node, children
+
+    def __fetch(self, ids):
+        if len(ids) == 1 or self.concurrency == 1:
+            return [self.__listing(id) for id in ids]
+
+        workers = ThreadPool(min(self.concurrency, len(ids)))
+        try:
+            return workers.map(self.__listing, ids, 1)
+        finally:
+            workers.close()
+            workers.join()
+
+    def __store(self, listings, now):
+        """
+        Grava as listagens e devolve os ids das filhas não finais cujas
+        listagens ainda não foram buscadas.
+        """
+        new = []
+        for id, node, children in listings:
+            if node is not None:
+                self._nodes[id] = node
+
+            previous = set(self._children.get(id, ()))
+            current = [child.id for child in children]
+            for child in children:
+                self._nodes[child.id] = child
+                self._parents[child.id] = id
+                if child.is_final:
+                    # Deixou de ter subcategorias
+                    for grandchild in self._children.pop(child.id, ()):
+                        self.__remove(grandchild)
+                    self._synced.pop(child.id, None)
+                    self._fingerprints.pop(child.id, None)
+                elif child.id not in self._synced and child.id not in new:
+                    new.append(child.id)
+
+            for removed in previous.difference(current):
+                self.__remove(removed)
+
+            self._children[id] = tuple(current)
+            self._synced[id] = now
+            self._fingerprints[id] = _fingerprint(children)
+        return new
+
+    def __remove(self, categoryID):
+        for child in self._children.pop(categoryID, ()):
+            self.__remove(child)
+        self._nodes.pop(categoryID, None)
+        self._parents.pop(categoryID, None)
+        self._synced.pop(categoryID, None)
+        self._fingerprints.pop(categoryID, None)
+
+    def __crawl(self, ids, now):
+        while ids:
+            listings = self.__fetch(ids)
+            with self._lock:
+                ids = self.__store(listings, now)
+
+    def __reindex(self):
+        words = []
+        for id, node in self._nodes.iteritems():
+            for word in set(_WORDS.findall(normalize(node.name))):
+                words.append((word, id))
+        words.sort()
+        self._words = words
+
+    def crawl(self):
+        """
+        Percorre a árvore inteira a partir de root, nível por nível, com
+        até concurrency requisições simultâneas.
+        """
+        with self._lock:
+            # As categorias que sumiram são removidas ao gravar as novas
+            # listagens
+            self._synced = {}
+        self.__crawl([self.root], time.time())
+        with self._lock:
+            self.__reindex()
+        return len(self._nodes)
+
+    def refresh(self, max_age=24 * 3600, limit=None):
+        """
+        Busca de novo as listagens buscadas há mais de max_age segundos (no
+        máximo limit delas, das mais antigas para as mais novas). Só as
+        subárvores cujas listagens mudaram são percorridas de novo.
+
+        Retorna quantas listagens mudaram.
+        """
+        now = time.time()
+        due = sorted((synced, id) for id, synced in self._synced.items()
+                     if now - synced >= max_age)
+        ids = [id for synced, id in due[:limit]]
+        if not ids:
+            return 0
+
+        listings = self.__fetch(ids)
+        changed = [listing for listing in listings
+                   if _fingerprint(listing[2]) !=
+                   self._fingerprints.get(listing[0])]
+
+        with self._lock:
+            for id, node, children in listings:
+                self._synced[id] = now
+                if node is not None:
+                    self._nodes[id] = node
+            new = self.__store(changed, now)
+        self.__crawl(new, now)
+
+        with self._lock:
+            self.__reindex()
+        return len(changed)
+
+    def schedule(self, interval, path=None, **kwargs):
+        """
+        Executa refresh(**kwargs) a cada interval segundos em uma thread
+        em segundo plano, gravando o índice em path quando algo mudar. Os
+        erros ficam em last_error e o refresh é tentado de novo no próximo
+        intervalo.
+        """
+        self.stop()
+        stop = self._stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                try:
+                    if self.refresh(**kwargs) and path:
+                        self.save(path)
+                    self.last_error = None
+                except Exception, e:
+                    self.last_error = e
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+
+    # Persistência
+
+    def save(self, path):
+        """
+        Grava o índice em path (o arquivo é substituído de uma vez só).
+        """
+        with self._lock:
+            state = dict(version=FORMAT_VERSION, root=self.root,
+                         nodes=self._nodes.values(), parents=self._parents,
+                         children=self._children, synced=self._synced,
+                         fingerprints=self._fingerprints)
+            data = pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.rename(tmp, path)
+
+    @classmethod
+    def load(cls, path, client=None, concurrency=4):
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        if state.get('version') != FORMAT_VERSION:
+            raise ValueError('unsupported category index version: {0}'
+                             ''.format(state.get('version')))
+
+        index = cls(client, state['root'], concurrency)
+        index._nodes = dict((node.id, node) for node in state['nodes'])
+        index._parents = state['parents']
+        index._children = state['children']
+        index._synced = state['synced']
+        index._fingerprints = state['fingerprints']
+        index.__reindex()
+        return index
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Resultados em colunas, para análises sobre muitas ofertas.
+"""
+
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from models import Offer, _bool
+
+# Campos usados por padrão em Columns de ofertas
+OFFER_FIELDS = ('id', 'product_id', 'seller_id', 'price')
+
+# Valor guardado nas colunas inteiras quando o campo não veio na resposta
+MISSING = -1
+
+NAN = float('nan')
+
+
+def _column(kind):
+    """
+    (coluna, função que acrescenta um valor) para o conversor kind do
+    modelo: int e bool em array('l'), float em array('d') e textos em
+    lista, com cada texto guardado uma única vez.
+    """
+    if kind is float:
+        column = array('d')
+        append = column.append
+
+        def add(value):
+            append(NAN if value is None else value)
+    elif kind in (int, _bool):
+        column = array('l')
+        append = column.append
+
+        def add(value):
+            append(MISSING if value is None else value)
+    else:
+        column = []
+        append = column.append
+        strings = {}
+
+        def add(value):
+            append(strings.setdefault(value, value))
+
+    return column, add
+
+
+def _to_numpy(column):
+    """
+    Cópia de um array.array como array do NumPy (ver Columns.as_numpy).
+    """
+    if not column:
+        # frombuffer não aceita buffers vazios
+        return numpy.empty(0, dtype=column.typecode)
+    return numpy.frombuffer(column, dtype=column.typecode).copy()
+
+
+class Columns(object):
+    """
+    Itens de um modelo guardados em colunas: os preços em array('d'), os
+    ids em array('l') e os textos em listas, com os textos repetidos
+    compartilhados. Ocupa uma fração da memória dos dicts ou modelos e,
+    com o NumPy instalado, as colunas podem ser copiadas para arrays do
+    NumPy (as_numpy).
+
+    Valores ausentes ficam como NaN nas colunas de ponto flutuante e como
+    MISSING (-1) nas inteiras.
+
+        columns = buscape.offer_columns(categoryID=77)
+        for product_id, (low, median, high, count) in \\
+                columns.stats().iteritems():
+            ...
+    """
+
+    def __init__(self, fields=OFFER_FIELDS, model=Offer):
+        specs = dict((name, kind) for name, path, kind in model.fields)
+        unknown = [name for name in fields if name not in specs]
+        if unknown:
+            raise ValueError('unknown fields for {0}: {1}'
+                             ''.format(model.tag, ', '.join(unknown)))
+
+        self.model = model
+        self.fields = tuple(fields)
+        self.columns = {}
+        self._adders = []
+        for name in self.fields:
+            column, add = _column(specs[name])
+            self.columns[name] = column
+            self._adders.append(add)
+
+    def append(self, item):
+        """
+        Acrescenta um item: um record com os campos na ordem de fields (ver
+        models.projection) ou um objeto do modelo.
+        """
+        if not isinstance(item, tuple):
+            item = [getattr(item, name) for name in self.fields]
+        for add, value in zip(self._adders, item):
+            add(value)
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def __len__(self):
+        return len(self.columns[self.fields[0]])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def as_numpy(self):
+        """
+        dict com cópias das colunas numéricas como arrays do NumPy. As
+        colunas de texto ficam de fora.
+
+        Não são views: no Python 2 o array.array não trava a sua memória
+        enquanto há um buffer aberto, e um append/extend posterior pode
+        realocá-la, deixando a view apontando para memória liberada.
+        """
+        if numpy is None:
+            raise RuntimeError('numpy is not installed')
+        return dict((name, _to_numpy(column))
+                    for name, column in self.columns.iteritems()
+                    if isinstance(column, array))
+
+    def stats(self, value='price', by='product_id', use_numpy=None):
+        """
+        Mínimo, mediana, máximo e quantidade de value para cada valor de
+        by: dict {by: (min, median, max, count)}. Os itens sem value ou sem
+        by são ignorados.
+
+        Usa o NumPy se estiver instalado (use_numpy=False força a versão em
+        Python puro).
+        """
+        values = self.columns[value]
+        keys = self.columns[by]
+        if not isinstance(values, array) or values.typecode != 'd':
+            raise ValueError('value must be a float column')
+        if not isinstance(keys, array):
+            raise ValueError('by must be an integer column')
+
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        if use_numpy:
+            return self.__numpy_stats(values, keys)
+
+        groups = {}
+        for key, number in zip(keys, values):
+            if key != MISSING and number == number:
+                groups.setdefault(key, []).append(number)
+
+        stats = {}
+        for key, numbers in groups.iteritems():
+            numbers.sort()
+            count = len(numbers)
+            median = (numbers[(count - 1) // 2] + numbers[count // 2]) / 2.0
+            stats[key] = (numbers[0], median, numbers[-1], count)
+        return stats
+
+    def __numpy_stats(self, values, keys):
+        if numpy is None:
+            raise RuntimeError('numpy is not installed')
+
+        values = _to_numpy(values)
+        keys = _to_numpy(keys)
+        valid = (keys != MISSING) & ~numpy.isnan(values)
+        values = values[valid]
+        keys = keys[valid]
+        if not len(keys):
+            return {}
+
+        # Ordena por chave e, dentro de cada chave, por valor
+        order = numpy.lexsort((values, keys))
+        values = values[order]
+        keys = keys[order]
+
+        starts = numpy.flatnonzero(numpy.r_[True, keys[1:] != keys[:-1]])
+        ends = numpy.r_[starts[1:], len(keys)]
+        counts = ends - starts
+        medians = (values[starts + (counts - 1) // 2] +
+                   values[starts + counts // 2]) / 2.0
+
+        return dict(
+            (key, (low, median, high, count))
+            for key, low, median, high, count in zip(
+                keys[starts].tolist(), values[starts].tolist(),
+                medians.tolist(), values[ends - 1].tolist(),
+                counts.tolist()))
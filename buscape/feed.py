@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+Acompanhamento de mudanças nas ofertas de produtos (find_offer_list).
+"""
+
+import heapq
+import threading
+import time
+
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+from buscape import MAX_PAGE
+
+# Campos de cada oferta que são comparados entre uma consulta e outra
+OfferState = namedtuple('OfferState', 'price installments installment_price '
+                                      'seller_id')
+
+# kind é 'added', 'removed' ou 'changed'; old e new são OfferState (old é
+# None para as ofertas novas e new é None para as removidas)
+OfferChange = namedtuple('OfferChange', 'kind product_id offer_id old new')
+
+OFFER_FIELDS = ('id',) + OfferState._fields
+
+
+class PriceFeed(object):
+    """
+    Consulta periodicamente as ofertas de um conjunto de produtos e
+    devolve só o que mudou: ofertas novas, removidas e com preço,
+    parcelamento ou loja diferentes (OfferChange).
+
+    De cada oferta é guardado só um OfferState. A frequência de consulta
+    de cada produto se adapta a quanto ele muda: change_rate é uma média
+    móvel da fração das consultas com mudanças, e o intervalo vai de
+    max_interval (produto que nunca muda) a min_interval (produto que muda
+    sempre).
+
+        feed = PriceFeed(buscape, productIDs)
+        for change in feed.stream():
+            ...
+    """
+
+    # Peso da última consulta na média de change_rate
+    smoothing = 0.3
+
+    def __init__(self, client, productIDs=(), min_interval=60,
+                 max_interval=3600, results=100, concurrency=4,
+                 emit_initial=True):
+        if not 0 < min_interval <= max_interval:
+            raise ValueError('min_interval must be positive and not greater '
+                             'than max_interval')
+        if not isinstance(concurrency, int) or concurrency < 1:
+            raise ValueError('concurrency must be a positive integer')
+
+        self.client = client
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.results = results
+        self.concurrency = concurrency
+        # Se as ofertas da primeira consulta de cada produto são emitidas
+        # como 'added'
+        self.emit_initial = emit_initial
+
+        self.change_rate = {}
+        self.errors = {}
+        self._offers = {}
+        self._due = {}
+        self._heap = []
+        self._lock = threading.Lock()
+
+        for productID in productIDs:
+            self.add(productID)
+
+    def add(self, productID, due=None):
+        """
+        Passa a acompanhar productID, com a primeira consulta em due
+        (time.time(); por padrão, agora).
+        """
+        with self._lock:
+            if productID not in self._due:
+                self.change_rate.setdefault(productID, 0.0)
+                self._schedule(productID, time.time() if due is None else due)
+
+    def remove(self, productID):
+        with self._lock:
+            self._due.pop(productID, None)
+            self._offers.pop(productID, None)
+            self.change_rate.pop(productID, None)
+            self.errors.pop(productID, None)
+
+    def __contains__(self, productID):
+        return productID in self._due
+
+    def __len__(self):
+        return len(self._due)
+
+    def _schedule(self, productID, due):
+        self._due[productID] = due
+        heapq.heappush(self._heap, (due, productID))
+
+    def interval(self, productID):
+        rate = self.change_rate.get(productID, 0.0)
+        return self.max_interval - (self.max_interval -
+                                    self.min_interval) * rate
+
+    def next_due(self):
+        """
+        time.time() da próxima consulta, ou None se não há produtos.
+        """
+        with self._lock:
+            self._discard_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def _discard_stale(self):
+        # Entradas de produtos removidos ou reagendados ficam no heap até
+        # chegarem ao topo
+        heap = self._heap
+        while heap and self._due.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+
+    def due(self, now=None, limit=None):
+        """
+        Retira do agendamento e retorna os produtos cuja consulta já
+        venceu, dos mais atrasados para os mais recentes.
+        """
+        now = time.time() if now is None else now
+        found = []
+        with self._lock:
+            while limit is None or len(found) < limit:
+                self._discard_stale()
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                due, productID = heapq.heappop(self._heap)
+                # Fica fora do heap até ser reagendado por update
+                self._due[productID] = None
+                found.append(productID)
+        return found
+
+    def diff(self, productID, offers):
+        """
+        Compara offers (records ou objetos com os campos de OFFER_FIELDS)
+        com a consulta anterior de productID e retorna as mudanças.
+        """
+        current = {}
+        for offer in offers:
+            current[offer.id] = OfferState(offer.price, offer.installments,
+                                           offer.installment_price,
+                                           offer.seller_id)
+
+        with self._lock:
+            previous = self._offers.get(productID)
+            if productID in self._due:
+                self._offers[productID] = current
+
+        if previous is None:
+            if not self.emit_initial:
+                return []
+            previous = {}
+
+        changes = []
+        for offerID, state in current.iteritems():
+            old = previous.get(offerID)
+            if old is None:
+                changes.append(OfferChange('added', productID, offerID, None,
+                                           state))
+            elif old != state:
+                changes.append(OfferChange('changed', productID, offerID,
+                                           old, state))
+        for offerID, old in previous.iteritems():
+            if offerID not in current:
+                changes.append(OfferChange('removed', productID, offerID, old,
+                                           None))
+        return changes
+
+    def update(self, productID, offers, now=None):
+        """
+        Registra uma nova consulta de productID: calcula as mudanças,
+        atualiza change_rate e agenda a próxima consulta.
+        """
+        first = productID not in self._offers
+        changes = self.diff(productID, offers)
+
+        with self._lock:
+            if productID not in self._due:
+                return changes  # Removido durante a consulta
+
+            if not first:
+                rate = self.change_rate.get(productID, 0.0)
+                self.change_rate[productID] = (
+                    (1 - self.smoothing) * rate +
+                    self.smoothing * (1.0 if changes else 0.0))
+            self.errors.pop(productID, None)
+            now = time.time() if now is None else now
+            self._schedule(productID, now + self.interval(productID))
+        return changes
+
+    def _fetch_page(self, productID, page):
+        return self.client._wait(self.client.find_offer_list(
+            productID=productID, results=self.results, page=page,
+            fields=OFFER_FIELDS))
+
+    def fetch(self, productID):
+        """
+        Ofertas atuais de productID (somente os campos de OFFER_FIELDS), de
+        todas as páginas: com só a primeira, as ofertas que mudam de página
+        entre uma consulta e outra apareceriam como removidas e novas.
+        """
+        result = self._fetch_page(productID, 1)
+        offers = list(result.items)
+        for page in range(2, min(result.total_pages or 1, MAX_PAGE) + 1):
+            offers.extend(self._fetch_page(productID, page).items)
+        return offers
+
+    def poll_product(self, productID):
+        return self.update(productID, self.fetch(productID))
+
+    def _poll(self, productID):
+        try:
+            return self.poll_product(productID)
+        except Exception, e:
+            with self._lock:
+                self.errors[productID] = e
+                if productID in self._due:
+                    self._schedule(productID,
+                                   time.time() + self.min_interval)
+            return []
+
+    def poll(self, limit=None):
+        """
+        Consulta os produtos vencidos (no máximo limit), com até
+        concurrency requisições simultâneas, e retorna as mudanças. Os
+        produtos cujas consultas falharam ficam em errors e são tentados
+        de novo depois de min_interval.
+        """
+        productIDs = self.due(limit=limit)
+        if len(productIDs) <= 1 or self.concurrency == 1:
+            results = [self._poll(productID) for productID in productIDs]
+        else:
+            workers = ThreadPool(min(self.concurrency, len(productIDs)))
+            try:
+                results = workers.map(self._poll, productIDs, 1)
+            finally:
+                workers.close()
+                workers.join()
+
+        return [change for changes in results for change in changes]
+
+    def stream(self, limit=None, idle=1.0):
+        """
+        Gerador que consulta os produtos à medida que vencem e devolve as
+        mudanças uma a uma, indefinidamente. Sem produtos vencidos espera
+        até o próximo (no máximo idle segundos por vez, para perceber
+        produtos adicionados).
+        """
+        while True:
+            for change in self.poll(limit):
+                yield change
+
+            due = self.next_due()
+            wait = idle if due is None else min(idle, due - time.time())
+            if wait > 0:
+                time.sleep(wait)
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from bisect import bisect_left
+
+# Limites (em segundos) dos buckets dos histogramas
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+PHASES = ('validate', 'build', 'connect', 'ttfb', 'read', 'parse')
+
+
+class Histogram(object):
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """
+        Pares (limite, contagem acumulada), como no formato do Prometheus.
+        """
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+
+class MetricsCollector(object):
+    """
+    Coleta a latência das requisições de um ou mais clientes Buscape
+    (duração total e de cada etapa), o número de requisições por status e
+    uso do cache e os bytes recebidos. export() gera o formato texto do
+    Prometheus.
+
+        metrics = MetricsCollector()
+        metrics.attach(buscape)
+        ...
+        print metrics.export()
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.durations = {}
+        self.phases = {}
+        self.requests = {}
+        self.bytes = {}
+        self._lock = threading.Lock()
+
+    def attach(self, client):
+        client.add_hook('after_response', self.observe)
+        client.add_hook('on_error', self.observe)
+        return self
+
+    def detach(self, client):
+        client.remove_hook('after_response', self.observe)
+        client.remove_hook('on_error', self.observe)
+
+    def __histogram(self, table, key):
+        histogram = table.get(key)
+        if histogram is None:
+            histogram = table[key] = Histogram(self.buckets)
+        return histogram
+
+    def observe(self, event):
+        method = event.method
+        status = event.status
+        if status is None:
+            status = 'error'
+
+        with self._lock:
+            self.__histogram(self.durations, method).observe(event.duration)
+            for phase in PHASES:
+                value = event.timings.get(phase)
+                if value is not None:
+                    self.__histogram(self.phases,
+                                     (method, phase)).observe(value)
+
+            key = (method, str(status), event.cache or 'none')
+            self.requests[key] = self.requests.get(key, 0) + 1
+            if event.size:
+                self.bytes[method] = self.bytes.get(method, 0) + event.size
+
+    def reset(self):
+        with self._lock:
+            self.durations.clear()
+            self.phases.clear()
+            self.requests.clear()
+            self.bytes.clear()
+
+    def export(self):
+        with self._lock:
+            lines = []
+
+            lines.append('# HELP buscape_request_duration_seconds '
+                         'Total duration of API requests.')
+            lines.append('# TYPE buscape_request_duration_seconds histogram')
+            for method, histogram in sorted(self.durations.items()):
+                _histogram_lines(lines, 'buscape_request_duration_seconds',
+                                 histogram, method=method)
+
+            lines.append('# HELP buscape_request_phase_seconds '
+                         'Duration of each phase of API requests.')
+            lines.append('# TYPE buscape_request_phase_seconds histogram')
+            for (method, phase), histogram in sorted(self.phases.items()):
+                _histogram_lines(lines, 'buscape_request_phase_seconds',
+                                 histogram, method=method, phase=phase)
+
+            lines.append('# HELP buscape_requests_total '
+                         'API requests by status and cache usage.')
+            lines.append('# TYPE buscape_requests_total counter')
+            for (method, status, cache), count in sorted(
+                    self.requests.items()):
+                lines.append('buscape_requests_total%s %d' % (
+                    _labels(method=method, status=status, cache=cache), count))
+
+            lines.append('# HELP buscape_response_bytes_total '
+                         'Bytes received from the API.')
+            lines.append('# TYPE buscape_response_bytes_total counter')
+            for method, size in sorted(self.bytes.items()):
+                lines.append('buscape_response_bytes_total%s %d' % (
+                    _labels(method=method), size))
+
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(**labels):
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\')
+                     .replace('"', '\\"'))
+        for name, value in sorted(labels.items()))
+
+
+def _histogram_lines(lines, name, histogram, **labels):
+    for bound, count in histogram.cumulative():
+        lines.append('%s_bucket%s %d' % (
+            name, _labels(le=repr(bound), **labels), count))
+    lines.append('%s_bucket%s %d' % (
+        name, _labels(le='+Inf', **labels), histogram.count))
+    lines.append('%s_sum%s %r' % (name, _labels(**labels), histogram.sum))
+    lines.append('%s_count%s %d' % (name, _labels(**labels), histogram.count))
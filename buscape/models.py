@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+Objetos de resultado da API do BuscaPé.
+
+Cada modelo declara, em fields, o caminho de cada atributo na resposta.
+O mesmo caminho serve para XML e JSON, pois as chaves do JSON da API são
+os nomes dos elementos e atributos do XML em minúsculas.
+"""
+
+from collections import namedtuple
+
+
+def local_name(tag):
+    """
+    Nome do elemento XML sem o namespace (urn:buscape), em minúsculas, que
+    é como as chaves aparecem nas respostas JSON.
+    """
+    if tag[0] == '{':
+        tag = tag.split('}', 1)[1]
+    return tag.lower()
+
+
+def _bool(value):
+    return value.lower() == 'true' if isinstance(value, basestring) \
+        else bool(value)
+
+
+def xml_value(elem, path):
+    """
+    Valor de path (tupla de nomes em minúsculas) a partir do elemento XML.
+    Cada nome pode ser um atributo ou um elemento filho.
+    """
+    for name in path:
+        for key, value in elem.attrib.iteritems():
+            if key.lower() == name:
+                return value
+
+        for child in elem:
+            if local_name(child.tag) == name:
+                elem = child
+                break
+        else:
+            return None
+
+    return elem.text
+
+
+def json_value(node, path):
+    """
+    Valor de path a partir de um dict do JSON da API. Listas usam o
+    primeiro item e os dicts de um item só ({"link": {...}}) são
+    desembrulhados.
+    """
+    for name in path:
+        if isinstance(node, list):
+            if not node:
+                return None
+            node = node[0]
+        if not isinstance(node, dict):
+            return None
+        if name not in node and len(node) == 1:
+            node = node.values()[0]
+            if isinstance(node, list):
+                node = node[0] if node else None
+            if not isinstance(node, dict):
+                return None
+        node = node.get(name)
+        if node is None:
+            return None
+
+    return node
+
+
+def _convert(value, kind):
+    if value is None or kind is None:
+        return value
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class Model(object):
+    """
+    Base dos modelos. Subclasses definem tag, __slots__ e fields, uma
+    tupla de (atributo, caminho, conversor).
+    """
+    __slots__ = ()
+    tag = None
+    fields = ()
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            setattr(self, name, kwargs.get(name))
+
+    @classmethod
+    def from_xml(cls, elem):
+        obj = cls.__new__(cls)
+        for name, path, kind in cls.fields:
+            setattr(obj, name, _convert(xml_value(elem, path), kind))
+        return obj
+
+    @classmethod
+    def from_json(cls, node):
+        obj = cls.__new__(cls)
+        for name, path, kind in cls.fields:
+            setattr(obj, name, _convert(json_value(node, path), kind))
+        return obj
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.as_dict() == other.as_dict()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '<%s id=%r>' % (self.__class__.__name__,
+                               getattr(self, 'id', None))
+
+
+def _fields(*specs):
+    return tuple((name, tuple(path.split('/')), kind)
+                 for name, path, kind in specs)
+
+
+class Offer(Model):
+    tag = 'offer'
+    fields = _fields(
+        ('id', 'id', int),
+        ('name', 'offername', unicode),
+        ('category_id', 'categoryid', int),
+        ('product_id', 'productid', int),
+        ('price', 'price/value', float),
+        ('currency', 'price/currency/abbreviation', unicode),
+        ('installments', 'price/parcel/number', int),
+        ('installment_price', 'price/parcel/value', float),
+        ('seller_id', 'seller/id', int),
+        ('seller_name', 'seller/sellername', unicode),
+        ('link', 'links/link/url', unicode),
+        ('thumbnail', 'thumbnail/url', unicode),
+    )
+    __slots__ = tuple(name for name, path, kind in fields)
+
+
+class Product(Model):
+    tag = 'product'
+    fields = _fields(
+        ('id', 'id', int),
+        ('name', 'productname', unicode),
+        ('category_id', 'categoryid', int),
+        ('price_min', 'pricemin', float),
+        ('price_max', 'pricemax', float),
+        ('total_sellers', 'totalsellers', int),
+        ('link', 'links/link/url', unicode),
+        ('thumbnail', 'thumbnail/url', unicode),
+    )
+    __slots__ = tuple(name for name, path, kind in fields)
+
+
+class Seller(Model):
+    tag = 'seller'
+    fields = _fields(
+        ('id', 'id', int),
+        ('name', 'sellername', unicode),
+        ('trusted', 'istrustedstore', _bool),
+        ('link', 'links/link/url', unicode),
+        ('thumbnail', 'thumbnail/url', unicode),
+    )
+    __slots__ = tuple(name for name, path, kind in fields)
+
+
+class Category(Model):
+    tag = 'category'
+    fields = _fields(
+        ('id', 'id', int),
+        ('parent_id', 'parentcategoryid', int),
+        ('name', 'name', unicode),
+        ('is_final', 'isfinal', _bool),
+        ('has_offer', 'hasoffer', _bool),
+        ('thumbnail', 'thumbnail/url', unicode),
+    )
+    __slots__ = tuple(name for name, path, kind in fields)
+
+
+class UserRating(Model):
+    tag = 'useraveragerating'
+    fields = _fields(
+        ('rating', 'rating', float),
+        ('num_comments', 'numcomments', int),
+    )
+    __slots__ = tuple(name for name, path, kind in fields)
+
+
+class Projection(object):
+    """
+    Extrai só alguns campos de um modelo, em tuplas nomeadas (o tipo
+    record). Os caminhos dos demais campos nem são visitados.
+
+    Tem a mesma interface de conversão dos modelos (from_xml e from_json);
+    use projection() para obtê-la.
+    """
+
+    def __init__(self, model, names):
+        specs = dict((name, (path, kind)) for name, path, kind in model.fields)
+        unknown = [name for name in names if name not in specs]
+        if unknown:
+            raise ValueError('unknown fields for {0}: {1}'
+                             ''.format(model.tag, ', '.join(unknown)))
+        if not names:
+            raise ValueError('fields must not be empty')
+
+        self.model = model
+        self.names = names
+        self.fields = tuple((name,) + specs[name] for name in names)
+        self.record = type(model.__name__ + 'Record',
+                           (namedtuple(model.__name__ + 'Record', names),),
+                           {'__slots__': (), '__reduce__': _reduce_record,
+                            '_projection': self})
+
+    def from_xml(self, elem):
+        return self.record._make([_convert(xml_value(elem, path), kind)
+                                  for name, path, kind in self.fields])
+
+    def from_json(self, node):
+        return self.record._make([_convert(json_value(node, path), kind)
+                                  for name, path, kind in self.fields])
+
+    def __reduce__(self):
+        return projection, (self.model, self.names)
+
+    def __repr__(self):
+        return '<Projection %s(%s)>' % (self.model.__name__,
+                                        ', '.join(self.names))
+
+
+def _reduce_record(record):
+    # Os tipos de record são criados dinamicamente; no pickle vão a
+    # projeção e os valores (para enviar resultados entre processos)
+    return _make_record, (record._projection, tuple(record))
+
+
+def _make_record(proj, values):
+    return proj.record._make(values)
+
+
+_projections = {}
+
+
+def projection(model, fields):
+    """
+    Projection de model com os campos fields (nomes dos atributos do
+    modelo, em uma sequência ou separados por vírgula). As projeções são
+    reaproveitadas, de modo que o mesmo pedido sempre usa o mesmo tipo de
+    record.
+    """
+    if isinstance(fields, basestring):
+        fields = fields.split(',')
+    key = (model, tuple(name.strip() for name in fields))
+
+    proj = _projections.get(key)
+    if proj is None:
+        proj = _projections.setdefault(key, Projection(*key))
+    return proj
+
+
+class Result(object):
+    """
+    Resposta interpretada. items traz os modelos encontrados na resposta;
+    page, total_pages e total_results só existem nas listagens.
+
+    data é a resposta bruta (XML ou JSON), para o que não vira modelo: o
+    sourceId de create_source_id, as especificações técnicas de
+    view_product_details, os endereços e telefones de view_seller_details.
+    Nas listagens data é None, para não guardar o texto junto dos
+    modelos.
+    """
+    __slots__ = ('code', 'url', 'page', 'total_pages', 'total_results',
+                 'items', 'data')
+
+    def __init__(self, code=None, url=None, page=None, total_pages=None,
+                 total_results=None, items=None, data=None):
+        self.code = code
+        self.url = url
+        self.page = page
+        self.total_pages = total_pages
+        self.total_results = total_results
+        self.items = items if items is not None else []
+        self.data = data
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __repr__(self):
+        return '<Result code=%r items=%d>' % (self.code, len(self.items))
+
+
+# Elemento da resposta -> modelo
+MODELS = {
+    'offer': Offer,
+    'product': Product,
+    'seller': Seller,
+    'category': Category,
+    'subcategory': Category,
+    'useraveragerating': UserRating,
+}
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Interpretação das respostas XML e JSON da API do BuscaPé.
+"""
+
+import json
+
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+
+from models import MODELS, Result, local_name
+
+# Decodificadores JSON, em ordem de preferência, usados se instalados
+JSON_BACKENDS = ('ujson', 'simplejson')
+
+
+def select_json_backend(names=JSON_BACKENDS):
+    """
+    O primeiro dos módulos names que puder ser importado, ou o json da
+    biblioteca padrão.
+    """
+    for name in names:
+        try:
+            return __import__(name)
+        except ImportError:
+            pass
+    return json
+
+json_backend = select_json_backend()
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def element_to_dict(elem):
+    """
+    Converte um elemento XML em dict no mesmo formato do JSON da API:
+    atributos e filhos viram chaves em minúsculas, elementos repetidos
+    viram listas.
+    """
+    node = dict((key.lower(), value) for key, value in elem.attrib.items())
+
+    for child in elem:
+        name = local_name(child.tag)
+        if len(child) or child.attrib:
+            value = element_to_dict(child)
+        else:
+            value = child.text
+
+        if name not in node:
+            node[name] = value
+        elif isinstance(node[name], list):
+            node[name].append(value)
+        else:
+            node[name] = [node[name], value]
+
+    text = (elem.text or '').strip()
+    if text and node:
+        node['text'] = text
+
+    return node
+
+
+def json_items(doc, tag):
+    """
+    Itens de um documento JSON da API. A API devolve listas no formato
+    [{"offer": {...}}, {"offer": {...}}]; aqui são retornados só os dicts
+    internos.
+    """
+    value = None
+    for key in doc:
+        if key.lower() == tag:
+            value = doc[key]
+            break
+
+    if value is None:
+        return []
+    if isinstance(value, dict):
+        value = [value]
+
+    items = []
+    for item in value:
+        if isinstance(item, dict) and len(item) == 1 and tag in item:
+            item = item[tag]
+        items.append(item)
+    return items
+
+
+def loads(data):
+    """
+    Decodifica uma resposta JSON direto do corpo recebido (str, sem
+    convertê-lo antes para unicode), usando ujson ou simplejson se algum
+    deles estiver instalado.
+    """
+    return json_backend.loads(data)
+
+
+def page_info(attrs):
+    """
+    Retorna (page, total_pages, total_results) a partir dos atributos do
+    elemento Result ou das chaves do documento JSON.
+    """
+    attrs = dict((key.lower(), value) for key, value in attrs.items())
+    return (to_int(attrs.get('page')), to_int(attrs.get('totalpages')),
+            to_int(attrs.get('totalresultsavailable')))
+
+
+def detect_format(data):
+    """
+    'json' ou 'xml', conforme o primeiro caractere da resposta.
+    """
+    return 'json' if data.lstrip()[:1] in ('{', '[') else 'xml'
+
+
+def parse_page(data, format, tag, models=False, projection=None):
+    """
+    Interpreta uma página de resultados de uma listagem (findOfferList,
+    findProductList, topProducts).
+
+    Retorna (page, total_pages, items), em que items são dicts dos
+    elementos tag ('offer', 'product', ...) ou, com models, objetos do
+    modelo correspondente. Com projection (ver models.projection) os itens
+    são records só com os campos pedidos.
+    """
+    model = projection or (MODELS[tag] if models else None)
+
+    if format == 'json':
+        doc = loads(data)
+        page, total_pages, total_results = page_info(doc)
+        items = json_items(doc, tag)
+        if model is not None:
+            items = [model.from_json(item) for item in items]
+        return page, total_pages, items
+
+    root = ElementTree.fromstring(data)
+    page, total_pages, total_results = page_info(root.attrib)
+    convert = model.from_xml if model is not None else element_to_dict
+    items = [convert(child) for child in root
+             if local_name(child.tag) == tag]
+    return page, total_pages, items
+
+
+def parse_result(resp, format=None, tags=None, projection=None):
+    """
+    Converte a resposta de __fetch_url (dict com code, data e url) em um
+    Result com os modelos de todos os itens conhecidos (ofertas, produtos,
+    lojas, categorias e avaliações).
+
+    tags limita os itens convertidos (ex.: ('offer',)); as demais partes
+    da resposta são ignoradas. Com projection só os itens do modelo da
+    projeção são convertidos, em records.
+
+    data fica None: a resposta bruta é acrescentada por quem chama (ver
+    Buscape), para não voltar inteira dos processos de parse_processes.
+    """
+    data = resp['data']
+    if format is None:
+        format = detect_format(data)
+
+    models = MODELS
+    if tags is not None:
+        models = dict((tag, MODELS[tag]) for tag in tags)
+    if projection is not None:
+        models = dict((tag, projection) for tag, model in models.items()
+                      if model is projection.model)
+
+    items = []
+    if format == 'json':
+        doc = loads(data)
+        page, total_pages, total_results = page_info(doc)
+        for key in doc:
+            model = models.get(key.lower())
+            if model is not None:
+                items.extend(model.from_json(item)
+                             for item in json_items(doc, key.lower()))
+    else:
+        root = ElementTree.fromstring(data)
+        page, total_pages, total_results = page_info(root.attrib)
+        for child in root:
+            model = models.get(local_name(child.tag))
+            if model is not None:
+                items.append(model.from_xml(child))
+
+    return Result(code=resp['code'], url=resp['url'], page=page,
+                  total_pages=total_pages, total_results=total_results,
+                  items=items)
+
+
+class StreamParser(object):
+    """
+    Interpreta uma página XML de forma incremental, a partir de um objeto
+    com read() (como a resposta HTTP), devolvendo os itens tag à medida que
+    chegam. Os elementos já processados são descartados, de modo que o uso
+    de memória não depende do tamanho da página.
+
+    page e total_pages ficam disponíveis assim que o elemento raiz é lido.
+    """
+
+    def __init__(self, stream, tag, models=False, projection=None):
+        self.stream = stream
+        self.tag = tag
+        self.models = models
+        self.projection = projection
+        self.page = None
+        self.total_pages = None
+        self.total_results = None
+
+    def __iter__(self):
+        model = self.projection or (MODELS[self.tag] if self.models else None)
+        convert = model.from_xml if model is not None else element_to_dict
+
+        depth = 0
+        root = None
+        for event, elem in ElementTree.iterparse(self.stream,
+                                                  ('start', 'end')):
+            if event == 'start':
+                depth += 1
+                if root is None:
+                    root = elem
+                    self.page, self.total_pages, self.total_results = \
+                        page_info(elem.attrib)
+                continue
+
+            depth -= 1
+            if depth == 1:
+                if local_name(elem.tag) == self.tag:
+                    yield convert(elem)
+                # Descarta os filhos da raiz que já foram processados
+                root.clear()
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+
+class TokenBucket(object):
+    """
+    Token bucket: rate fichas por segundo, acumulando no máximo capacity.
+
+    acquire() nunca falha: se não houver ficha disponível a chamada reserva
+    a próxima e espera por ela, de modo que as requisições saem na ordem em
+    que chegaram e no ritmo configurado.
+    """
+
+    def __init__(self, rate, capacity=None):
+        if not rate or rate <= 0:
+            raise ValueError('rate must be greater than zero')
+        if capacity is None:
+            capacity = max(rate, 1)
+
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = self.capacity
+        self.requests = 0
+        self.waited = 0.0
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self._updated = now
+
+    def reserve(self, tokens=1):
+        """
+        Reserva tokens e retorna quantos segundos é preciso esperar antes de
+        usá-los.
+        """
+        with self._lock:
+            self._refill(time.time())
+            self.tokens -= tokens
+            self.requests += 1
+            if self.tokens >= 0:
+                return 0.0
+            wait = -self.tokens / self.rate
+            self.waited += wait
+            return wait
+
+    def acquire(self, tokens=1):
+        wait = self.reserve(tokens)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def available(self):
+        """
+        Fichas disponíveis agora (negativo se há requisições na fila).
+        """
+        with self._lock:
+            self._refill(time.time())
+            return self.tokens
+
+    def wait_time(self):
+        """
+        Quanto tempo uma nova requisição esperaria agora.
+        """
+        tokens = self.available()
+        return max(0.0, (1 - tokens) / self.rate)
+
+    def stats(self):
+        return dict(rate=self.rate, capacity=self.capacity,
+                    available=self.available(), wait_time=self.wait_time(),
+                    requests=self.requests, waited=self.waited)
+
+
+class RateLimiter(object):
+    """
+    Limita as requisições feitas à API, por applicationID e, opcionalmente,
+    por método.
+
+    rate e burst são o limite padrão de cada applicationID (requisições
+    por segundo e rajada máxima). application_limits e method_limits
+    recebem dicts {applicationID: (rate, burst)} e
+    {método: (rate, burst)}; o limite de um método vale separadamente para
+    cada applicationID. Uma requisição precisa de ficha em todos os limites
+    que se aplicam a ela.
+    """
+
+    def __init__(self, rate=None, burst=None, application_limits=None,
+                 method_limits=None):
+        self.rate = rate
+        self.burst = burst
+        self.application_limits = dict(application_limits or {})
+        self.method_limits = dict(method_limits or {})
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, key, limit):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(*limit)
+            return bucket
+
+    def buckets(self, applicationID, method=None):
+        buckets = []
+
+        limit = self.application_limits.get(applicationID)
+        if limit is None and self.rate:
+            limit = (self.rate, self.burst)
+        if limit is not None:
+            buckets.append(self._bucket((applicationID, None), limit))
+
+        if method in self.method_limits:
+            buckets.append(self._bucket((applicationID, method),
+                                        self.method_limits[method]))
+
+        return buckets
+
+    def acquire(self, applicationID, method=None):
+        """
+        Aguarda até que a requisição possa ser feita. Retorna o tempo
+        esperado, em segundos.
+        """
+        waits = [bucket.reserve() for bucket in
+                 self.buckets(applicationID, method)]
+        wait = max(waits or [0.0])
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def wait_time(self, applicationID, method=None):
+        return max([bucket.wait_time() for bucket in
+                    self.buckets(applicationID, method)] or [0.0])
+
+    def budget(self, applicationID, method=None):
+        """
+        Quantas requisições podem ser feitas agora sem esperar.
+        """
+        buckets = self.buckets(applicationID, method)
+        if not buckets:
+            return None
+        return max(0, int(min(bucket.available() for bucket in buckets)))
+
+    def stats(self):
+        """
+        Métricas de cada limite em uso, por (applicationID, método); o
+        método é None no limite geral do applicationID.
+        """
+        with self._lock:
+            buckets = self._buckets.items()
+        return dict((key, bucket.stats()) for key, bucket in buckets)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import random
+import time
+
+from urllib2 import URLError, HTTPError
+
+
+class RetryPolicy(object):
+    """
+    Política de novas tentativas para as requisições (todas são GET, e
+    portanto podem ser repetidas).
+
+    Falhas de conexão, timeouts e os status HTTP em statuses são tentados
+    novamente até retries vezes, esperando backoff * 2 ** tentativa
+    segundos (no máximo max_backoff); com jitter a espera é sorteada entre
+    zero e esse valor. deadline limita, em segundos, o tempo total da
+    chamada, incluindo esperas e timeouts de cada tentativa.
+    """
+
+    def __init__(self, retries=3, backoff=0.1, max_backoff=5.0, jitter=True,
+                 deadline=None, statuses=(429, 500, 502, 503, 504)):
+        if not isinstance(retries, int) or retries < 0:
+            raise ValueError('retries must be a non-negative integer')
+
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.deadline = deadline
+        self.statuses = statuses
+
+    def start(self):
+        """
+        Momento (time.time()) em que a chamada deve terminar, ou None.
+        """
+        if self.deadline is None:
+            return None
+        return time.time() + self.deadline
+
+    def retryable(self, error):
+        if isinstance(error, HTTPError):
+            return error.code in self.statuses
+        return isinstance(error, URLError)
+
+    def delay(self, attempt):
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+    def next_delay(self, error, attempt, deadline=None):
+        """
+        Quanto esperar antes da próxima tentativa, ou None se a requisição
+        não deve ser repetida.
+        """
+        if attempt >= self.retries or not self.retryable(error):
+            return None
+
+        delay = self.delay(attempt)
+        if deadline is not None and time.time() + delay >= deadline:
+            return None
+        return delay
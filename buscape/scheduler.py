@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Agendamento das consultas de uma lista de produtos acompanhados, dentro
+de um limite de requisições por segundo.
+"""
+
+import threading
+import time
+
+from feed import PriceFeed
+from ratelimit import TokenBucket
+
+
+class WatchlistScheduler(PriceFeed):
+    """
+    Decide qual produto da lista consultar a seguir e faz as consultas
+    (find_offer_list e, com details, view_product_details) com workers
+    threads, sem passar de rate requisições por segundo no total.
+
+    Os produtos ficam em um heap ordenado pelo momento em que a
+    desatualização (staleness) de cada um, ponderada pela sua frequência de
+    mudança (change_rate, ver PriceFeed) e pela sua popularidade, chega ao
+    limite: o intervalo de cada produto é max_interval dividido por
+
+        (1 + change_weight * change_rate) * (1 + popularity_weight *
+                                             popularity)
+
+    e nunca menor que min_interval. A popularidade (de 0 a 1) vem da
+    posição do produto em top_products, buscado a cada popularity_every
+    segundos.
+
+    Para cada consulta callback(productID, changes, details) é chamado na
+    thread do worker, com as mudanças nas ofertas (OfferChange) e o
+    resultado de view_product_details (None sem details).
+
+        scheduler = WatchlistScheduler(buscape, productIDs, rate=5,
+                                       callback=salvar)
+        scheduler.start()
+    """
+
+    def __init__(self, client, productIDs=(), rate=5, burst=None, workers=8,
+                 details=False, callback=None, min_interval=60,
+                 max_interval=3600, change_weight=4, popularity_weight=2,
+                 popularity_every=3600, top_results=100, **kwargs):
+        if not isinstance(workers, int) or workers < 1:
+            raise ValueError('workers must be a positive integer')
+
+        self.popularity = {}
+        self.change_weight = change_weight
+        self.popularity_weight = popularity_weight
+        super(WatchlistScheduler, self).__init__(
+            client, productIDs, min_interval=min_interval,
+            max_interval=max_interval, concurrency=workers, **kwargs)
+
+        # O orçamento vale para todas as requisições do agendador,
+        # inclusive top_products
+        self.bucket = TokenBucket(rate, burst)
+        self.workers = workers
+        self.details = details
+        self.callback = callback
+        self.popularity_every = popularity_every
+        self.top_results = top_results
+
+        self.last_error = None
+        self._popularity_at = None
+        self._popularity_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._threads = []
+
+    def interval(self, productID):
+        weight = ((1 + self.change_weight *
+                   self.change_rate.get(productID, 0.0)) *
+                  (1 + self.popularity_weight *
+                   self.popularity.get(productID, 0.0)))
+        return max(self.min_interval, self.max_interval / float(weight))
+
+    def refresh_popularity(self):
+        """
+        Atualiza popularity a partir de top_products: 1 para o primeiro
+        produto, caindo até perto de 0 para o último.
+        """
+        self.bucket.acquire()
+        result = self.client._wait(self.client.top_products(
+            results=self.top_results, fields=('id',)))
+
+        ids = [product.id for product in result.items]
+        self.popularity = dict((id, 1 - rank / float(len(ids)))
+                               for rank, id in enumerate(ids))
+        self._popularity_at = time.time()
+
+    def __check_popularity(self):
+        if not self.popularity_every:
+            return
+        # Só um worker atualiza; os outros seguem com a popularidade atual
+        if not self._popularity_lock.acquire(False):
+            return
+        try:
+            at = self._popularity_at
+            if at is None or time.time() - at >= self.popularity_every:
+                self.refresh_popularity()
+        finally:
+            self._popularity_lock.release()
+
+    def _fetch_page(self, productID, page):
+        self.bucket.acquire()
+        return super(WatchlistScheduler, self)._fetch_page(productID, page)
+
+    def poll_product(self, productID):
+        changes = super(WatchlistScheduler, self).poll_product(productID)
+
+        details = None
+        if self.details:
+            self.bucket.acquire()
+            details = self.client._wait(
+                self.client.view_product_details(productID=productID))
+
+        if self.callback is not None:
+            self.callback(productID, changes, details)
+        return changes
+
+    def __work(self, idle):
+        while not self._stopped.is_set():
+            try:
+                self.__check_popularity()
+            except Exception, e:
+                # Sem popularidade atualizada o agendamento continua
+                self.last_error = e
+
+            productIDs = self.due(limit=1)
+            if productIDs:
+                self._poll(productIDs[0])
+                continue
+
+            due = self.next_due()
+            wait = idle if due is None else min(idle, due - time.time())
+            if wait > 0:
+                self._stopped.wait(wait)
+
+    def start(self, idle=1.0):
+        """
+        Inicia os workers em threads em segundo plano. Sem produtos
+        vencidos cada worker espera até o próximo (no máximo idle segundos
+        por vez).
+        """
+        if self._threads:
+            raise RuntimeError('scheduler is already running')
+
+        self._stopped.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.__work, args=(idle,))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """
+        Para os workers, esperando as consultas em andamento terminarem.
+        """
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
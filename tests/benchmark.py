@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark do cliente contra um servidor local que imita a API do BuscaPé.
+
+O servidor responde a todos os métodos (XML e JSON) com respostas geradas
+no formato da API, de modo que só o custo do cliente é medido: requisições
+por segundo e latência (síncrono e concorrente), velocidade de
+interpretação das respostas e memória por item.
+
+    python benchmark.py --requests 200 --concurrency 16 --output bench.json
+
+O resultado é um JSON, para comparar versões.
+"""
+
+import json
+import optparse
+import os
+import platform
+import sys
+import threading
+import time
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from multiprocessing.pool import ThreadPool
+from urlparse import parse_qsl, urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+import buscape
+from buscape import Buscape
+from buscape.parser import parse_page
+
+APPLICATION_ID = 'benchmark'
+
+
+def offer(i):
+    return {
+        'id': str(i), 'categoryid': '77', 'productid': str(i % 50 + 1),
+        'offername': 'Oferta %d' % i,
+        'links': [{'link': {'url': 'http://www.buscape.com.br/o/%d' % i,
+                            'type': 'offer'}}],
+        'thumbnail': {'url': 'http://thumbs.buscape.com.br/o/%d.jpg' % i},
+        'price': {'currency': {'abbreviation': 'BRL'},
+                  'value': '%.2f' % (100 + i % 900),
+                  'parcel': {'value': '%.2f' % ((100 + i % 900) / 10.0),
+                             'number': '10', 'interest': '0'}},
+        'seller': {'id': str(i % 200 + 1), 'istrustedstore': 'true',
+                   'sellername': 'Loja %d' % (i % 200 + 1),
+                   'links': [{'link': {'url': 'http://loja/%d' % i,
+                                       'type': 'seller'}}]},
+    }
+
+
+def product(i):
+    return {
+        'id': str(i), 'categoryid': '77', 'totalsellers': str(i % 30 + 1),
+        'productname': 'Produto %d' % i,
+        'pricemin': '%.2f' % (100 + i % 900),
+        'pricemax': '%.2f' % (200 + i % 900),
+        'links': [{'link': {'url': 'http://www.buscape.com.br/p/%d' % i,
+                            'type': 'product'}}],
+        'thumbnail': {'url': 'http://thumbs.buscape.com.br/p/%d.jpg' % i},
+    }
+
+
+def seller(i):
+    return {'id': str(i), 'sellername': 'Loja %d' % i,
+            'istrustedstore': 'true',
+            'links': [{'link': {'url': 'http://loja/%d' % i,
+                                'type': 'seller'}}]}
+
+
+def category(i):
+    return {'id': str(i), 'parentcategoryid': '0', 'isfinal': 'true',
+            'hasoffer': 'true', 'name': 'Categoria %d' % i}
+
+
+def rating(i):
+    return {'rating': '4.5', 'numcomments': '12'}
+
+
+# Método da API -> (elemento, gerador de item, lista de resultados?)
+ENDPOINTS = {
+    'findOfferList': ('offer', offer, True),
+    'findProductList': ('product', product, True),
+    'topProducts': ('product', product, True),
+    'findCategoryList': ('subCategory', category, True),
+    'viewProductDetails': ('product', product, False),
+    'viewSellerDetails': ('seller', seller, False),
+    'viewUserRatings': ('userAverageRating', rating, False),
+}
+
+# Nomes dos elementos XML (as chaves JSON são os mesmos nomes em
+# minúsculas)
+XML_NAMES = dict((name.lower(), name) for name in (
+    'offerName', 'categoryId', 'productId', 'productName', 'priceMin',
+    'priceMax', 'totalSellers', 'sellerName', 'isTrustedStore',
+    'parentCategoryId', 'isFinal', 'hasOffer', 'numComments',
+    'subCategory', 'userAverageRating'))
+
+# Chaves que na API são atributos no XML
+XML_ATTRIBUTES = set(['id', 'categoryid', 'productid', 'totalsellers',
+                      'istrustedstore', 'parentcategoryid', 'isfinal',
+                      'hasoffer', 'url', 'type', 'abbreviation'])
+
+
+def to_xml(tag, node):
+    name = XML_NAMES.get(tag, tag)
+    if not isinstance(node, dict):
+        return '<%s>%s</%s>' % (name, node, name)
+
+    attrs = []
+    children = []
+    for key, value in sorted(node.items()):
+        if key in XML_ATTRIBUTES:
+            attrs.append(' %s="%s"' % (XML_NAMES.get(key, key), value))
+        elif isinstance(value, list):
+            inner = ''.join(to_xml(k, v) for item in value
+                            for k, v in item.items())
+            children.append('<%s>%s</%s>' % (key, inner, key))
+        else:
+            children.append(to_xml(key, value))
+
+    return '<%s%s>%s</%s>' % (name, ''.join(attrs), ''.join(children), name)
+
+
+def render(method, format, results, page):
+    tag, make, is_list = ENDPOINTS[method]
+    count = results if is_list else 1
+    start = (page - 1) * count + 1
+    items = [make(i) for i in range(start, start + count)]
+    total_pages = 10
+
+    if format == 'json':
+        doc = {'details': {'code': 0, 'status': 'success'}, 'page': page,
+               'totalpages': total_pages,
+               'totalresultsavailable': total_pages * count,
+               tag.lower(): [{tag.lower(): item} for item in items]}
+        return json.dumps(doc)
+
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<Result xmlns="urn:buscape" page="%d" totalPages="%d" '
+            'totalResultsAvailable="%d"><details><code>0</code>'
+            '<status>success</status></details>%s</Result>' % (
+                page, total_pages, total_pages * count,
+                ''.join(to_xml(tag.lower(), item) for item in items)))
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Envia cada resposta de uma vez, sem esperar o ACK do cliente
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    responses_cache = {}
+    lock = threading.Lock()
+
+    def do_GET(self):
+        # /service/<método>[/lomadee]/<applicationID>/<país>/?<parâmetros>
+        url = urlsplit(self.path)
+        parts = [p for p in url.path.split('/') if p]
+        method = parts[1]
+        query = dict(parse_qsl(url.query))
+        key = (method, query.get('format', 'xml'),
+               int(query.get('results', 10)), int(query.get('page', 1)))
+
+        with self.lock:
+            body = self.responses_cache.get(key)
+            if body is None:
+                body = self.responses_cache[key] = render(*key)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/%s' % key[1])
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class MockServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), MockHandler)
+        self.host = '127.0.0.1:%d' % self.server_port
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    index = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(latencies, elapsed):
+    return {
+        'requests': len(latencies),
+        'requests_per_second': len(latencies) / elapsed,
+        'latency_ms': dict(
+            (name, percentile(latencies, p) * 1000)
+            for name, p in (('p50', 50), ('p90', 90), ('p99', 99),
+                            ('max', 100))),
+    }
+
+
+def calls(results):
+    return {
+        'find_offer_list': dict(productID=1, results=results),
+        'find_product_list': dict(keyword='celular', results=results),
+        'top_products': dict(results=results),
+        'find_category_list': dict(categoryID=0),
+        'view_product_details': dict(productID=1),
+        'view_seller_details': dict(sellerID=1),
+        'view_user_ratings': dict(productID=1),
+    }
+
+
+def bench_requests(client, name, kwargs, requests, concurrency):
+    method = getattr(client, name)
+
+    def timed(i):
+        start = time.time()
+        method(**kwargs)
+        return time.time() - start
+
+    # Aquece a conexão e o servidor
+    method(**kwargs)
+
+    start = time.time()
+    sync = [timed(i) for i in range(requests)]
+    sync_result = summarize(sync, time.time() - start)
+
+    workers = ThreadPool(concurrency)
+    try:
+        start = time.time()
+        concurrent = workers.map(timed, range(requests), 1)
+        concurrent_result = summarize(concurrent, time.time() - start)
+    finally:
+        workers.close()
+        workers.join()
+
+    return {'sync': sync_result, 'concurrent': concurrent_result}
+
+
+def deep_size(obj, seen=None):
+    """
+    Tamanho aproximado de obj em bytes, incluindo os objetos referenciados.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen)
+                    for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(deep_size(item, seen) for item in obj)
+    elif hasattr(obj, '__slots__'):
+        size += sum(deep_size(getattr(obj, name, None), seen)
+                    for name in obj.__slots__)
+    return size
+
+
+def bench_parsing(results, repeat):
+    report = {}
+    for format in ('xml', 'json'):
+        data = render('findOfferList', format, results, 1)
+        for models in (False, True):
+            start = time.time()
+            for i in range(repeat):
+                items = parse_page(data, format, 'offer', models)[2]
+            elapsed = time.time() - start
+
+            mode = 'models' if models else 'dicts'
+            report['%s_%s' % (format, mode)] = {
+                'items_per_second': results * repeat / elapsed,
+                'mb_per_second': len(data) * repeat / elapsed / 2 ** 20,
+                'bytes_per_item': deep_size(items) / float(len(items)),
+            }
+    return report
+
+
+def main(argv=None):
+    parser = optparse.OptionParser()
+    parser.add_option('--requests', type='int', default=200,
+                      help='requisições por método e modo')
+    parser.add_option('--concurrency', type='int', default=16)
+    parser.add_option('--results', type='int', default=100,
+                      help='itens por página nas listagens')
+    parser.add_option('--parse-repeat', type='int', default=20)
+    parser.add_option('--output', help='arquivo JSON (padrão: stdout)')
+    options, args = parser.parse_args(argv)
+
+    server = MockServer()
+    try:
+        report = {
+            'buscape': buscape.buscape.__version__,
+            'python': platform.python_version(),
+            'settings': dict(requests=options.requests,
+                             concurrency=options.concurrency,
+                             results=options.results),
+            'requests': {},
+        }
+
+        for format in ('xml', 'json'):
+            client = Buscape(APPLICATION_ID, host=server.host,
+                             pool_size=options.concurrency)
+            client.set_default_format(format)
+            client.freeze()
+            for name, kwargs in sorted(calls(options.results).items()):
+                report['requests']['%s_%s' % (name, format)] = \
+                    bench_requests(client, name, kwargs, options.requests,
+                                   options.concurrency)
+            client.pool.clear()
+
+        report['parsing'] = bench_parsing(options.results,
+                                          options.parse_repeat)
+    finally:
+        server.stop()
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output)
+    else:
+        print output
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,288 @@
 # -*- coding: utf-8 -*-
 import unittest
 import json
+import gzip
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import types
+import warnings
+import zlib
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from cStringIO import StringIO
 from urllib2 import URLError, HTTPError
+from urlparse import parse_qsl, urlsplit
 import sys
 
 sys.path.insert(0, '..')
-from buscape import Buscape
+from buscape import Buscape, AsyncBuscape, LRUCache, Offer, Result
+from buscape import RateLimiter, RetryPolicy, SQLiteCache, TieredCache
+from buscape import BarcodeIndex, BarcodeResolver, CategoryIndex, Columns
+from buscape import MetricsCollector, PriceFeed, WatchlistScheduler
+from buscape import TruncatedResultsWarning
+from buscape.buscape import ConnectionPool
+from buscape.parser import StreamParser, loads, parse_result
+from buscape.parser import select_json_backend
+
+
+def _fill_cache(path):
+    SQLiteCache(path).set('from-child', {'code': 200}, 60)
+
+
+class LocalHandler(BaseHTTPRequestHandler):
+    """
+    Responde com keep-alive; o corpo é o endereço do cliente, o que
+    permite saber se a conexão foi reaproveitada.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path.startswith('/slow'):
+            time.sleep(0.5)
+        encoding = None
+        if self.path.startswith('/missing'):
+            code, body = 404, 'not found'
+        elif self.path.startswith('/gzip'):
+            code, body, encoding = 200, LocalHandler.compressible, 'gzip'
+            buf = StringIO()
+            gz = gzip.GzipFile(fileobj=buf, mode='wb')
+            gz.write(body)
+            gz.close()
+            body = buf.getvalue()
+        elif self.path.startswith('/deflate'):
+            code, encoding = 200, 'deflate'
+            body = zlib.compress(LocalHandler.compressible)
+        else:
+            code, body = 200, '%s:%s' % self.client_address
+        self.send_response(code)
+        if encoding and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+LocalHandler.compressible = '<offer id="1"/>' * 1000
+
+
+class QuietHTTPServer(HTTPServer):
+    def handle_error(self, request, client_address):
+        # Clientes que desistem por timeout fecham a conexão antes da
+        # resposta (Broken pipe); não há nada a registrar
+        pass
+
+
+class LocalServer(object):
+    def __init__(self, handler=LocalHandler):
+        self.httpd = QuietHTTPServer(('127.0.0.1', 0), handler)
+        self.url = 'http://127.0.0.1:%s' % self.httpd.server_port
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+OFFER_XML = (
+    '<Result xmlns="urn:buscape" page="1" totalPages="1" '
+    'totalResultsAvailable="1"><details><code>0</code></details>'
+    '<offer id="10" categoryId="77" productId="5">'
+    '<offerName>Celular</offerName>'
+    '<links><link url="http://x/10" type="offer"/></links>'
+    '<price><currency abbreviation="BRL"/><value>599.90</value>'
+    '<parcel><value>59.99</value><number>10</number></parcel></price>'
+    '<seller id="3" isTrustedStore="true"><sellerName>Loja</sellerName>'
+    '</seller></offer></Result>'
+)
+
+OFFER_JSON = json.dumps({
+    'details': {'code': 0}, 'page': 1, 'totalpages': 1,
+    'totalresultsavailable': 1,
+    'offer': [{'offer': {
+        'id': '10', 'categoryid': '77', 'productid': '5',
+        'offername': 'Celular',
+        'links': [{'link': {'url': 'http://x/10', 'type': 'offer'}}],
+        'price': {'currency': {'abbreviation': 'BRL'}, 'value': '599.90',
+                  'parcel': {'value': '59.99', 'number': '10'}},
+        'seller': {'id': '3', 'istrustedstore': 'true',
+                   'sellername': 'Loja'},
+    }}],
+})
+
+
+class FakeResponse(object):
+    def __init__(self, data, code=200):
+        self.code = code
+        self.data = data
+
+    def read(self, amt=None):
+        if amt is None:
+            amt = len(self.data)
+        data, self.data = self.data[:amt], self.data[amt:]
+        return data
+
+    def close(self):
+        self.closed = True
+
+
+class FakePool(object):
+    """
+    Substitui o ConnectionPool nos testes que não devem acessar a rede.
+    """
+    def __init__(self, data='{"details": {"code": 0}}', delay=0):
+        self.data = data
+        self.delay = delay
+        self.urls = []
+        self.timeouts = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def urlopen(self, url, headers=None, timeout=None):
+        with self._lock:
+            self.urls.append(url)
+            self.timeouts.append(timeout)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self._lock:
+            self.in_flight -= 1
+        return FakeResponse(self.data)
+
+
+class FlakyPool(FakePool):
+    """
+    Falha com errors[0], errors[1], ... antes de responder normalmente.
+    """
+    def __init__(self, errors):
+        FakePool.__init__(self)
+        self.errors = list(errors)
+
+    def urlopen(self, url, headers=None, timeout=None):
+        resp = FakePool.urlopen(self, url, headers)
+        if self.errors:
+            raise self.errors.pop(0)
+        return resp
+
+
+class PagedPool(FakePool):
+    """
+    Serve páginas de ofertas/produtos de acordo com os parâmetros page e
+    format da URL.
+    """
+    def __init__(self, total_pages=3, per_page=2, tag='offer'):
+        FakePool.__init__(self)
+        self.total_pages = total_pages
+        self.per_page = per_page
+        self.tag = tag
+
+    def urlopen(self, url, headers=None, timeout=None):
+        FakePool.urlopen(self, url, headers)
+        query = dict(parse_qsl(urlsplit(url).query))
+        page = int(query['page'])
+        ids = range((page - 1) * self.per_page + 1, page * self.per_page + 1)
+        if query['format'] == 'json':
+            data = json.dumps({
+                'page': page, 'totalpages': self.total_pages,
+                self.tag: [{self.tag: {'id': str(i)}} for i in ids],
+            })
+        else:
+            data = ('<Result xmlns="urn:buscape" page="%s" totalPages="%s">'
+                    '%s</Result>' % (page, self.total_pages, ''.join(
+                        '<%s id="%s"/>' % (self.tag, i) for i in ids)))
+        return FakeResponse(data)
+
+
+class CategoryPool(FakePool):
+    """
+    Serve findCategoryList a partir de tree: {categoryId: [(id, nome,
+    final), ...]}.
+    """
+    def __init__(self, tree):
+        FakePool.__init__(self)
+        self.tree = tree
+
+    def urlopen(self, url, headers=None, timeout=None):
+        FakePool.urlopen(self, url, headers)
+        parent = int(dict(parse_qsl(urlsplit(url).query))['categoryId'])
+        data = ''.join(
+            '<subCategory id="%d" parentCategoryId="%d" isFinal="%s">'
+            '<name>%s</name></subCategory>' % (
+                id, parent, str(final).lower(), name.encode('utf-8'))
+            for id, name, final in self.tree.get(parent, ()))
+        return FakeResponse('<Result xmlns="urn:buscape">%s</Result>' % data)
+
+
+class BarcodePool(FakePool):
+    """
+    Responde findOfferList com uma oferta do produto products[barcode].
+    """
+    def __init__(self, products):
+        FakePool.__init__(self, delay=0.1)
+        self.products = products
+
+    def urlopen(self, url, headers=None, timeout=None):
+        FakePool.urlopen(self, url, headers)
+        barcode = dict(parse_qsl(urlsplit(url).query))['barcode']
+        if barcode == '1':
+            raise URLError('connection refused')
+        productID = self.products.get(barcode)
+        offer = '<offer id="1" productId="%s"/>' % productID if productID \
+            else ''
+        return FakeResponse('<Result xmlns="urn:buscape">%s</Result>' % offer)
+
+
+class OfferPool(FakePool):
+    """
+    Responde findOfferList com offers[productID]: [(id, preço, loja)],
+    paginadas de acordo com results e page.
+    """
+    def __init__(self, offers):
+        FakePool.__init__(self)
+        self.offers = offers
+
+    def urlopen(self, url, headers=None, timeout=None):
+        FakePool.urlopen(self, url, headers)
+        if '/topProducts/' in url:
+            return FakeResponse('<Result xmlns="urn:buscape">'
+                                '<product id="2"/><product id="1"/></Result>')
+        query = dict(parse_qsl(urlsplit(url).query))
+        productID = int(query['productID'])
+        results, page = int(query['results']), int(query['page'])
+        offers = self.offers.get(productID, [])
+        data = ''.join(
+            '<offer id="%d" productId="%d"><price><value>%.2f</value>'
+            '</price><seller id="%d"/></offer>' % (id, productID, price,
+                                                   seller)
+            for id, price, seller in offers[(page - 1) * results:
+                                            page * results])
+        return FakeResponse(
+            '<Result xmlns="urn:buscape" page="%d" totalPages="%d">%s'
+            '</Result>' % (page, max(1, -(-len(offers) // results)), data))
+
+
+class CountryPool(FakePool):
+    """
+    Demora delays[país] segundos (padrão 0.1) para responder, com
+    bodies[país] (padrão data).
+    """
+    def __init__(self, delays, data=OFFER_XML, bodies=None):
+        FakePool.__init__(self, data)
+        self.delays = delays
+        self.bodies = bodies or {}
+
+    def urlopen(self, url, headers=None, timeout=None):
+        country = urlsplit(url).path.split('/')[4]
+        FakePool.urlopen(self, url, headers, timeout)
+        time.sleep(self.delays.get(country, 0.1))
+        return FakeResponse(self.bodies.get(country, self.data))
 
 
 class BuscapeTest(unittest.TestCase):
@@ -15,7 +292,7 @@ class BuscapeTest(unittest.TestCase):
         self.b.set_sandbox()
 
     def _get_code(self, resp):
-        json_resp = json.loads(resp['data'])
+        json_resp = loads(resp['data'])
         return json_resp['details']['code']
 
     def test_set_default_format(self):
@@ -383,6 +660,910 @@ class BuscapeFastTest(BuscapeTest):
             productID='y',
         )
 
+    def test_connection_pool_reuses_connections(self):
+        server = LocalServer()
+        pool = ConnectionPool(maxsize=2)
+        try:
+            first = pool.urlopen(server.url + '/a').read()
+            second = pool.urlopen(server.url + '/b').read()
+            self.assertEqual(first, second)
+            self.assertEqual(pool.idle_connections(), 1)
+
+            self.assertRaises(HTTPError, pool.urlopen, server.url + '/missing')
+        finally:
+            pool.clear()
+            server.stop()
+
+    def test_connection_pool_evicts_idle_connections(self):
+        server = LocalServer()
+        pool = ConnectionPool(maxsize=2, idle_timeout=0)
+        try:
+            first = pool.urlopen(server.url + '/a').read()
+            self.assertEqual(pool.idle_connections(), 0)
+            second = pool.urlopen(server.url + '/b').read()
+            self.assertNotEqual(first, second)
+        finally:
+            pool.clear()
+            server.stop()
+
+    def test_connection_pool_size(self):
+        self.assertRaisesMessage(
+            ValueError,
+            'maxsize must be a positive integer',
+            Buscape,
+            applicationID=self.applicationID, pool_size=0,
+        )
+
+        pool = ConnectionPool()
+        buscape = Buscape(self.applicationID, pool=pool)
+        self.assertTrue(buscape.pool is pool)
+
+    def test_async_buscape(self):
+        pool = FakePool(delay=0.05)
+        buscape = AsyncBuscape(self.applicationID, max_concurrency=3,
+                               pool=pool)
+        try:
+            # A validação continua acontecendo na chamada
+            self.assertRaisesMessage(
+                ValueError,
+                'productID option must be specified',
+                buscape.view_product_details,
+            )
+
+            results = [buscape.view_product_details(productID=i)
+                       for i in range(1, 10)]
+            responses = [result.get(5) for result in results]
+        finally:
+            buscape.close()
+
+        self.assertEqual([r['code'] for r in responses], [200] * 9)
+        self.assertTrue('productId=1' in responses[0]['url'])
+        self.assertEqual(len(pool.urls), 9)
+        self.assertTrue(pool.max_in_flight <= 3)
+
+        self.assertRaisesMessage(
+            ValueError,
+            'max_concurrency must be a positive integer',
+            AsyncBuscape,
+            applicationID=self.applicationID, max_concurrency=0,
+        )
+
+    def test_async_request_options(self):
+        pool = CountryPool({'AR': 0})
+        buscape = AsyncBuscape(self.applicationID, pool=pool)
+        try:
+            # As opções valem na thread que executa a requisição
+            with buscape.request_options(country='AR', timeout=0.5):
+                result = buscape.view_product_details(productID=1)
+            self.assertTrue('/AR/' in result.get(5)['url'])
+            self.assertEqual(pool.timeouts, [0.5])
+
+            results = buscape.search_countries('top_products', ['AR', 'CL'],
+                                               timeout={'CL': 0.3})
+        finally:
+            buscape.close()
+        self.assertEqual([r['error'] for r in results], [None, None])
+        self.assertEqual(sorted(pool.timeouts[1:]), [None, 0.3])
+
+    def test_response_cache(self):
+        pool = FakePool()
+        cache = LRUCache(maxsize=2)
+        buscape = Buscape(self.applicationID, pool=pool, cache=cache,
+                          cache_ttls={'findOfferList': 0})
+
+        first = buscape.view_product_details(productID=1)
+        first['data'] = 'changed'
+        second = buscape.view_product_details(productID=1)
+        self.assertEqual(len(pool.urls), 1)
+        self.assertEqual(second['data'], pool.data)
+        self.assertEqual(cache.stats(), dict(hits=1, misses=1, size=1))
+
+        # TTL zero desliga o cache para o método
+        buscape.find_offer_list(productID=1)
+        buscape.find_offer_list(productID=1)
+        self.assertEqual(len(pool.urls), 3)
+
+        # Sem cache para createSource
+        buscape.create_source_id(sourceName='x', publisherID=1, siteID=1,
+                                 token='t')
+        self.assertEqual(len(cache), 1)
+
+    def test_lru_cache(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1, 60)
+        cache.set('b', 2, 60)
+        cache.get('a')
+        cache.set('c', 3, 60)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+
+        cache.set('d', 4, -1)
+        self.assertEqual(cache.get('d'), None)
+
+    def test_iter_offers(self):
+        for format in ('xml', 'json'):
+            pool = PagedPool(total_pages=3, per_page=2)
+            buscape = Buscape(self.applicationID, pool=pool)
+            offers = list(buscape.iter_offers(productID=1, format=format))
+            self.assertEqual([o['id'] for o in offers],
+                             ['1', '2', '3', '4', '5', '6'])
+            self.assertEqual(len(pool.urls), 3)
+
+        pool = PagedPool(total_pages=5, per_page=2, tag='product')
+        buscape = Buscape(self.applicationID, pool=pool)
+        products = buscape.iter_top_products(page=4, prefetch=False)
+        self.assertEqual([p['id'] for p in products], ['7', '8', '9', '10'])
+
+        # Além da página 998 os resultados são cortados, com um aviso
+        buscape = Buscape(self.applicationID,
+                          pool=PagedPool(total_pages=1500, per_page=1))
+        for stream in (False, True):
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                offers = list(buscape.iter_offers(productID=1, page=997,
+                                                  stream=stream))
+            self.assertEqual([o['id'] for o in offers], ['997', '998'])
+            self.assertEqual(len(caught), 1)
+            self.assertTrue(issubclass(caught[0].category,
+                                       TruncatedResultsWarning))
+            self.assertTrue('1500 pages' in str(caught[0].message))
+
+        self.assertRaisesMessage(
+            ValueError,
+            'One parameter must be especified',
+            buscape.iter_offers,
+        )
+
+    def test_models(self):
+        for data, format in ((OFFER_XML, 'xml'), (OFFER_JSON, 'json')):
+            buscape = Buscape(self.applicationID, pool=FakePool(data),
+                              models=True)
+            result = buscape.find_offer_list(productID=5, format=format)
+            self.assertTrue(isinstance(result, Result))
+            self.assertEqual(result.code, 200)
+            self.assertEqual(result.total_pages, 1)
+            self.assertEqual(len(result), 1)
+
+            offer = result.items[0]
+            self.assertTrue(isinstance(offer, Offer))
+            self.assertFalse(hasattr(offer, '__dict__'))
+            self.assertEqual(offer.as_dict(), {
+                'id': 10, 'name': u'Celular', 'category_id': 77,
+                'product_id': 5, 'price': 599.9, 'currency': u'BRL',
+                'installments': 10, 'installment_price': 59.99,
+                'seller_id': 3, 'seller_name': u'Loja',
+                'link': u'http://x/10', 'thumbnail': None,
+            })
+
+            offers = list(buscape.iter_offers(productID=5, format=format))
+            self.assertEqual(offers, [offer])
+
+            resp = dict(code=200, url='', data=data)
+            self.assertEqual(parse_result(resp, tags=('offer',)).items,
+                             [offer])
+            self.assertEqual(parse_result(resp, tags=('seller',)).items, [])
+
+        # O que não vira modelo continua disponível na resposta bruta
+        data = ('<Result xmlns="urn:buscape"><details><code>0</code>'
+                '</details><lomadee><sourceId>123</sourceId></lomadee>'
+                '</Result>')
+        buscape = Buscape(self.applicationID, pool=FakePool(data),
+                          models=True)
+        result = buscape.create_source_id(sourceName='x', publisherID=1,
+                                          siteID=1, token='t')
+        self.assertEqual(result.items, [])
+        self.assertEqual(result.data, data)
+        self.assertEqual(buscape.find_offer_list(productID=5).data, None)
+        self.assertEqual(buscape.find_offer_list(productID=5,
+                                                 fields=('id',)).data, None)
+
+    def test_json_backend(self):
+        # ujson, depois simplejson, depois o json da biblioteca padrão
+        ujson = types.ModuleType('ujson')
+        simplejson = types.ModuleType('simplejson')
+        saved = dict((name, sys.modules.get(name))
+                     for name in ('ujson', 'simplejson'))
+        try:
+            sys.modules.update(ujson=ujson, simplejson=simplejson)
+            self.assertTrue(select_json_backend() is ujson)
+            sys.modules['ujson'] = None  # import levanta ImportError
+            self.assertTrue(select_json_backend() is simplejson)
+            sys.modules['simplejson'] = None
+            self.assertTrue(select_json_backend() is json)
+        finally:
+            for name, module in saved.items():
+                if module is None:
+                    del sys.modules[name]
+                else:
+                    sys.modules[name] = module
+
+    def test_fields(self):
+        fields = ('id', 'price', 'seller_id', 'product_id')
+        for data, format in ((OFFER_XML, 'xml'), (OFFER_JSON, 'json')):
+            buscape = Buscape(self.applicationID, pool=FakePool(data))
+            result = buscape.find_offer_list(productID=5, format=format,
+                                             fields=fields)
+            self.assertTrue(isinstance(result, Result))
+            record = result.items[0]
+            self.assertEqual(record, (10, 599.9, 3, 5))
+            self.assertEqual(record.seller_id, 3)
+            self.assertEqual(record._fields, fields)
+
+            records = list(buscape.iter_offers(productID=5, format=format,
+                                               fields='id,price'))
+            self.assertEqual(records, [(10, 599.9)])
+            self.assertEqual(type(records[0]).__name__, 'OfferRecord')
+
+        self.assertRaisesMessage(
+            ValueError, 'unknown fields for offer: size',
+            buscape.find_offer_list, productID=5, fields=('id', 'size'))
+
+    def test_parse_processes(self):
+        buscape = Buscape(self.applicationID, pool=PagedPool(total_pages=3),
+                          models=True, parse_processes=2)
+        try:
+            offers = list(buscape.iter_offers(productID=1))
+            self.assertEqual([o.id for o in offers], [1, 2, 3, 4, 5, 6])
+            self.assertTrue(isinstance(offers[0], Offer))
+
+            records = list(buscape.iter_offers(productID=1, format='json',
+                                               fields=('id', 'price')))
+            self.assertEqual(records[-1], (6, None))
+            self.assertEqual(records[-1].id, 6)
+
+            buscape.pool = FakePool(OFFER_XML)
+            results = buscape.view_product_details_many([1, 2])
+            self.assertEqual(results[1]['result'].items[0].price, 599.9)
+            # Só os itens voltam do processo; a resposta bruta é a do pai
+            self.assertEqual(results[1]['result'].data, OFFER_XML)
+            self.assertEqual(buscape.parse_pool.apply(
+                parse_result, (dict(code=200, url='', data=OFFER_XML),)
+            ).data, None)
+        finally:
+            buscape.close()
+        self.assertTrue(buscape.parse_pool is None)
+
+        self.assertRaisesMessage(
+            ValueError, 'parse_processes must be a positive integer',
+            Buscape, self.applicationID, parse_processes=0)
+
+    def test_category_index(self):
+        tree = {
+            0: [(1, u'Eletrônicos', False), (2, u'Casa', False)],
+            1: [(10, u'Telefones Celulares', True), (11, u'TVs', True)],
+            2: [(20, u'Cama e Mesa', True)],
+        }
+        pool = CategoryPool(tree)
+        buscape = Buscape(self.applicationID, pool=pool)
+        index = CategoryIndex(buscape, concurrency=2)
+        self.assertEqual(index.crawl(), 5)
+        self.assertEqual(len(pool.urls), 3)
+
+        self.assertEqual(index.parent(10).name, u'Eletrônicos')
+        self.assertEqual([c.id for c in index.children(1)], [10, 11])
+        self.assertEqual([c.id for c in index.ancestors(10)], [1])
+        self.assertEqual(sorted(c.id for c in index.descendants(0)),
+                         [1, 2, 10, 11, 20])
+        self.assertEqual(index.resolve('celular').id, 10)
+        self.assertEqual([c.id for c in index.find('eletronicos')], [1])
+        self.assertEqual(index.find('tel cel')[0].id, 10)
+        self.assertEqual(index.find('geladeira'), [])
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'categorias.idx')
+            index.save(path)
+            index = CategoryIndex.load(path, buscape)
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(index.resolve('cama').id, 20)
+
+        # Só a subárvore que mudou é percorrida de novo
+        tree[2] = [(20, u'Cama e Mesa', True), (21, u'Cozinha', False)]
+        tree[21] = [(210, u'Panelas', True)]
+        del pool.urls[:]
+        self.assertEqual(index.refresh(max_age=60), 0)
+        self.assertEqual(index.refresh(max_age=0), 1)
+        self.assertEqual(len(pool.urls), 4)
+        self.assertEqual([c.id for c in index.ancestors(210)], [21, 2])
+
+        tree[0] = [(2, u'Casa', False)]
+        index.refresh(max_age=0)
+        self.assertFalse(10 in index)
+        self.assertEqual(index.find('tvs'), [])
+
+    def test_barcode_resolver(self):
+        pool = BarcodePool({'7891234567895': 10, '0012345678905': 20})
+        buscape = Buscape(self.applicationID, pool=pool)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'barcodes.idx')
+            resolver = BarcodeResolver(buscape, path, concurrency=4)
+            barcodes = ['7891234567895', '0012345678905', '12345678905',
+                        '7890000000000', 7891234567895]
+            start = time.time()
+            self.assertEqual(resolver.resolve_barcodes(barcodes), {
+                '7891234567895': 10, '0012345678905': 20,
+                '12345678905': 20, '7890000000000': None,
+                7891234567895: 10,
+            })
+            # Uma requisição por GTIN, em paralelo
+            self.assertEqual(len(pool.urls), 3)
+            self.assertTrue(time.time() - start < 0.25)
+
+            # Os códigos desconhecidos também ficam no índice, que é
+            # gravado em disco
+            resolver = BarcodeResolver(buscape, path)
+            self.assertEqual(len(resolver.index), 3)
+            self.assertEqual(resolver.resolve('7890000000000'), None)
+            self.assertEqual(resolver.resolve(12345678905), 20)
+            self.assertEqual(len(pool.urls), 3)
+
+            resolver.negative_ttl = 0
+            resolver.resolve('7890000000000')
+            self.assertEqual(len(pool.urls), 4)
+
+            errors = {}
+            self.assertEqual(resolver.resolve_barcodes(['1', '7891234567895'],
+                                                       errors), {
+                '7891234567895': 10})
+            self.assertTrue(isinstance(errors['1'], URLError))
+            self.assertRaises(URLError, resolver.resolve_barcodes, ['1'])
+            self.assertRaisesMessage(ValueError, "invalid barcode: 'x1'",
+                                     resolver.resolve, 'x1')
+
+            # O formato do arquivo não depende do tamanho de long: 24 bytes
+            # por entrada, com GTINs de 14 dígitos exatos
+            index = BarcodeIndex()
+            index.set(99999999999999, 2 ** 40)
+            index.set(7891234567895, 10)
+            index.save(path)
+            self.assertEqual(os.path.getsize(path), 16 + 2 * 24)
+            index = BarcodeIndex(path)
+            self.assertEqual(index.get(99999999999999)[0], 2 ** 40)
+            self.assertEqual(index.get(99999999999998), None)
+            self.assertEqual(index.get(7891234567895)[0], 10)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_price_feed(self):
+        offers = {1: [(10, 100.0, 3), (11, 120.0, 4)], 2: [(20, 50.0, 3)]}
+        pool = OfferPool(offers)
+        feed = PriceFeed(Buscape(self.applicationID, pool=pool), [1, 2],
+                         min_interval=10, max_interval=100)
+
+        changes = feed.poll()
+        self.assertEqual(sorted((c.kind, c.offer_id) for c in changes),
+                         [('added', 10), ('added', 11), ('added', 20)])
+        self.assertEqual(feed.poll(), [])
+        self.assertEqual(len(pool.urls), 2)
+        self.assertTrue(feed.next_due() > time.time() + 90)
+
+        offers[1] = [(10, 95.0, 3), (12, 130.0, 5)]
+        changes = feed.poll_product(1)
+        self.assertEqual(sorted(changes), [
+            ('added', 1, 12, None, (130.0, None, None, 5)),
+            ('changed', 1, 10, (100.0, None, None, 3),
+             (95.0, None, None, 3)),
+            ('removed', 1, 11, (120.0, None, None, 4), None),
+        ])
+        # Produtos que mudam são consultados com mais frequência
+        self.assertEqual(feed.poll_product(2), [])
+        self.assertTrue(feed.interval(1) < feed.interval(2))
+        self.assertEqual(feed.interval(2), 100)
+
+        feed.remove(2)
+        self.assertEqual(len(feed), 1)
+        self.assertEqual(feed.due(now=time.time() + 1000), [1])
+
+        # Todas as páginas são consultadas: uma oferta que muda de página
+        # não aparece como removida
+        offers[3] = [(30, 10.0, 1), (31, 20.0, 1), (32, 30.0, 1)]
+        feed = PriceFeed(Buscape(self.applicationID, pool=pool), [3],
+                         results=2)
+        del pool.urls[:]
+        self.assertEqual(len(feed.poll_product(3)), 3)
+        self.assertEqual(len(pool.urls), 2)
+        offers[3].reverse()
+        self.assertEqual(feed.poll_product(3), [])
+
+    def test_watchlist_scheduler(self):
+        pool = OfferPool({1: [(10, 100.0, 3)], 2: [(20, 50.0, 3)]})
+        polled = []
+        scheduler = WatchlistScheduler(
+            Buscape(self.applicationID, pool=pool), [1, 2], rate=5, burst=1,
+            workers=2, min_interval=1, max_interval=60,
+            callback=lambda id, changes, details: polled.append(
+                (id, len(changes))))
+
+        start = time.time()
+        scheduler.start(idle=0.05)
+        try:
+            while len(polled) < 2 and time.time() - start < 5:
+                time.sleep(0.01)
+        finally:
+            scheduler.stop()
+
+        self.assertEqual(sorted(polled), [(1, 1), (2, 1)])
+        # top_products e as duas consultas de ofertas, a 5 por segundo
+        self.assertEqual(len(pool.urls), 3)
+        self.assertTrue(time.time() - start >= 0.4)
+
+        self.assertEqual(scheduler.popularity, {2: 1.0, 1: 0.5})
+        self.assertTrue(scheduler.interval(2) < scheduler.interval(1))
+        self.assertEqual(scheduler.interval(2), 20)
+
+    def test_search_countries(self):
+        pool = CountryPool({'VE': 1})
+        buscape = Buscape(self.applicationID, pool=pool, models=True)
+
+        start = time.time()
+        results = buscape.search_countries(
+            'find_offer_list', ['AR', 'BR', 'CL', 'VE'],
+            timeout={'VE': 0.2}, keyword='tv')
+        self.assertTrue(time.time() - start < 0.5)
+
+        self.assertEqual([r['country'] for r in results],
+                         ['AR', 'BR', 'CL', 'VE'])
+        for r in results[:3]:
+            self.assertEqual(r['error'], None)
+            self.assertEqual(r['result'].items[0].id, 10)
+            self.assertTrue('/%s/' % r['country'] in r['result'].url)
+        self.assertEqual(results[3]['result'], None)
+        self.assertTrue(isinstance(results[3]['error'],
+                                   multiprocessing.TimeoutError))
+        # O país padrão do cliente não muda
+        self.assertEqual(buscape.country, 'BR')
+
+        self.assertRaisesMessage(
+            ValueError, 'method must be one of: find_product_list, '
+            'find_offer_list, top_products',
+            buscape.search_countries, 'view_user_ratings', productID=1)
+        self.assertRaises(ValueError, buscape.search_countries,
+                          'find_offer_list', ['XX'], keyword='tv')
+        self.assertRaisesMessage(
+            ValueError, 'One parameter must be especified',
+            buscape.search_countries, 'find_offer_list', ['AR'])
+        self.assertRaises(ValueError, buscape.search_countries,
+                          'top_products', ['AR'], fields=('nope',))
+        self.assertEqual(len(pool.urls), 4)
+
+        # Uma resposta inválida é o erro só daquele país
+        pool = CountryPool({}, OFFER_JSON, bodies={'CL': '{"offer": ['})
+        buscape = Buscape(self.applicationID, pool=pool, models=True)
+        results = buscape.search_countries('find_offer_list', ['AR', 'CL'],
+                                           keyword='tv', format='json')
+        self.assertEqual(results[0]['result'].items[0].id, 10)
+        self.assertEqual(results[1]['result'], None)
+        self.assertTrue(isinstance(results[1]['error'], ValueError))
+
+    def test_offer_columns(self):
+        buscape = Buscape(self.applicationID, pool=PagedPool(total_pages=2,
+                                                             per_page=3))
+        columns = buscape.offer_columns(productID=1,
+                                        fields=('id', 'product_id', 'price',
+                                                'seller_name'))
+        self.assertEqual(len(columns), 6)
+        self.assertEqual(list(columns['id']), [1, 2, 3, 4, 5, 6])
+        self.assertEqual(list(columns['product_id']), [-1] * 6)
+        self.assertEqual(columns['id'].typecode, 'l')
+        self.assertEqual(columns['price'].typecode, 'd')
+
+        columns = Columns(('product_id', 'price', 'seller_name'))
+        columns.extend([(1, 10.0, u'Loja'), (1, 30.0, u'Loja'),
+                        (1, 20.0, u'Outra'), (2, 5.0, u'Loja'),
+                        (2, 7.0, u'Loja'), (2, None, None),
+                        (None, 1.0, None)])
+        self.assertTrue(columns['seller_name'][0] is
+                        columns['seller_name'][1])
+        expected = {1: (10.0, 20.0, 30.0, 3), 2: (5.0, 6.0, 7.0, 2)}
+        self.assertEqual(columns.stats(use_numpy=False), expected)
+        try:
+            import numpy
+        except ImportError:
+            pass
+        else:
+            self.assertEqual(columns.stats(use_numpy=True), expected)
+            prices = columns.as_numpy()['price']
+            columns.extend([(3, 1.0, None)] * 1000)
+            self.assertEqual(len(prices), 7)
+            self.assertEqual(prices[0], 10.0)
+
+    def test_iter_offers_stream(self):
+        pool = PagedPool(total_pages=3, per_page=2)
+        buscape = Buscape(self.applicationID, pool=pool, models=True)
+        offers = list(buscape.iter_offers(productID=1, stream=True))
+        self.assertEqual([o.id for o in offers], [1, 2, 3, 4, 5, 6])
+        self.assertEqual(len(pool.urls), 3)
+
+        self.assertRaisesMessage(
+            ValueError,
+            'stream is only supported for the xml format',
+            buscape.iter_offers,
+            productID=1, format='json', stream=True,
+        )
+
+    def test_stream_parser_is_incremental(self):
+        data = ('<Result xmlns="urn:buscape" page="1" totalPages="7">' +
+                '<offer id="1"/>' * 5000 + '</Result>')
+        stream = FakeResponse(data)
+        parser = StreamParser(stream, 'offer')
+        first = iter(parser).next()
+        self.assertEqual(first, {'id': '1'})
+        self.assertEqual(parser.total_pages, 7)
+        self.assertTrue(len(stream.data) > 0)
+
+    def test_view_product_details_many(self):
+        pool = FakePool(delay=0.02)
+        buscape = Buscape(self.applicationID, pool=pool)
+        results = buscape.view_product_details_many(
+            [3, 1, 3, None, 2, 1], concurrency=2)
+
+        self.assertEqual([r['id'] for r in results], [3, 1, 3, None, 2, 1])
+        self.assertEqual(len(pool.urls), 3)
+        self.assertTrue(pool.max_in_flight <= 2)
+        self.assertTrue('productId=3' in results[0]['result']['url'])
+        self.assertTrue(results[0]['result'] is results[2]['result'])
+
+        self.assertEqual(results[3]['result'], None)
+        self.assertTrue(isinstance(results[3]['error'], ValueError))
+
+        results = buscape.view_seller_details_many([1, 'x'])
+        self.assertEqual(results[0]['error'], None)
+        self.assertTrue(isinstance(results[1]['error'], AssertionError))
+
+        self.assertRaisesMessage(
+            ValueError,
+            'concurrency must be a positive integer',
+            buscape.view_seller_details_many,
+            [1], concurrency=0,
+        )
+
+    def test_request_options(self):
+        pool = FakePool(delay=0.01)
+        buscape = Buscape(self.applicationID, pool=pool)
+        buscape.freeze()
+
+        self.assertRaisesMessage(
+            RuntimeError,
+            'client is frozen; use request_options instead',
+            buscape.set_clientIp,
+            '200.200.200.200',
+        )
+
+        urls = {}
+
+        def worker(ip):
+            with buscape.request_options(clientIp=ip, format='json',
+                                         environment='sandbox'):
+                urls[ip] = [buscape.view_product_details(productID=1)['url']
+                            for i in range(5)]
+
+        threads = [threading.Thread(target=worker, args=('10.0.0.%d' % i,))
+                   for i in range(1, 5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for ip, ip_urls in urls.items():
+            for url in ip_urls:
+                self.assertTrue(url.startswith('http://sandbox.'))
+                self.assertTrue('clientIp=' + ip in url)
+                self.assertTrue('format=json' in url)
+
+        url = buscape.view_product_details(productID=1)['url']
+        self.assertTrue(url.startswith('http://bws.'))
+        self.assertFalse('clientIp' in url)
+
+        # As opções valem para toda a iteração, inclusive o prefetch
+        pool = PagedPool(total_pages=2)
+        buscape = Buscape(self.applicationID, pool=pool)
+        with buscape.request_options(clientIp='10.0.0.9'):
+            offers = buscape.iter_offers(productID=1)
+        list(offers)
+        self.assertEqual(len(pool.urls), 2)
+        self.assertTrue(all('clientIp=10.0.0.9' in u for u in pool.urls))
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(rate=20, burst=2,
+                              method_limits={'findOfferList': (10, 1)})
+        pool = FakePool()
+        buscape = Buscape(self.applicationID, pool=pool,
+                          rate_limiter=limiter)
+
+        self.assertEqual(limiter.budget(self.applicationID), 2)
+
+        start = time.time()
+        for i in range(6):
+            buscape.view_product_details(productID=1)
+        elapsed = time.time() - start
+        self.assertEqual(len(pool.urls), 6)
+        self.assertTrue(0.15 < elapsed < 1, elapsed)
+
+        stats = limiter.stats()[(self.applicationID, None)]
+        self.assertEqual(stats['requests'], 6)
+        self.assertTrue(stats['waited'] > 0)
+        self.assertTrue(limiter.wait_time(self.applicationID) > 0)
+
+        # O limite do método vale junto com o do applicationID
+        time.sleep(0.1)
+        start = time.time()
+        buscape.find_offer_list(productID=1, lomadee=True)
+        buscape.find_offer_list(productID=1)
+        self.assertTrue(time.time() - start > 0.08)
+        self.assertTrue((self.applicationID, 'findOfferList') in
+                        limiter.stats())
+
+        self.assertEqual(RateLimiter().budget(self.applicationID), None)
+
+    def test_retry(self):
+        url = 'http://sandbox.buscape.com/'
+        unavailable = HTTPError(url, 503, 'Unavailable', {}, None)
+        pool = FlakyPool([URLError('reset'), unavailable])
+        buscape = Buscape(self.applicationID, pool=pool,
+                          retry=RetryPolicy(retries=2, backoff=0.01))
+        self.assertEqual(buscape.view_product_details(productID=1)['code'],
+                         200)
+        self.assertEqual(len(pool.urls), 3)
+
+        # Erros do cliente não são repetidos
+        pool = FlakyPool([HTTPError(url, 404, 'Not Found', {}, None)])
+        buscape = Buscape(self.applicationID, pool=pool,
+                          retry=RetryPolicy(retries=2, backoff=0.01))
+        self.assertRaises(HTTPError, buscape.view_product_details,
+                          productID=1)
+        self.assertEqual(len(pool.urls), 1)
+
+        # O deadline limita o tempo total da chamada
+        pool = FlakyPool([URLError('reset')] * 100)
+        buscape = Buscape(self.applicationID, pool=pool,
+                          retry=RetryPolicy(retries=100, backoff=0.05,
+                                            jitter=False, deadline=0.3))
+        start = time.time()
+        self.assertRaises(URLError, buscape.view_product_details,
+                          productID=1)
+        self.assertTrue(time.time() - start < 0.3)
+        self.assertTrue(1 < len(pool.urls) < 100)
+
+    def test_connection_pool_timeout(self):
+        server = LocalServer()
+        pool = ConnectionPool()
+        try:
+            self.assertRaises(URLError, pool.urlopen, server.url + '/slow',
+                              timeout=(1, 0.1))
+            self.assertTrue(pool.urlopen(server.url + '/slow',
+                                         timeout=(1, 2)).read())
+
+            # O timeout de uma requisição não passa para a próxima que
+            # reaproveita a mesma conexão
+            first = pool.urlopen(server.url, timeout=0.2).read()
+            self.assertEqual(pool.urlopen(server.url + '/slow').read(),
+                             first)
+        finally:
+            pool.clear()
+            server.stop()
+
+    def test_coalesce(self):
+        pool = FakePool(delay=0.2)
+        buscape = Buscape(self.applicationID, pool=pool, coalesce=True,
+                          models=True)
+        results = []
+
+        def worker():
+            results.append(buscape.view_product_details(productID=1))
+
+        threads = [threading.Thread(target=worker) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(pool.urls), 1)
+        self.assertEqual(len(results), 10)
+        self.assertTrue(all(r is results[0] for r in results))
+        self.assertEqual(buscape.single_flight.stats(),
+                         dict(calls=1, shared=9))
+
+        # Chamadas que não são simultâneas fazem novas requisições
+        buscape.view_product_details(productID=1)
+        self.assertEqual(len(pool.urls), 2)
+
+        # Cada chamada agrupada dispara os seus próprios hooks
+        events = []
+        buscape.add_hook('before_request', lambda e: events.append('before'))
+        buscape.add_hook('after_response', lambda e: events.append(
+            (e.status, e.cache)))
+        threads = [threading.Thread(target=worker) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(pool.urls), 3)
+        self.assertEqual(sorted(events), ['before'] * 5 + [
+            (200, None)] + [(200, 'coalesced')] * 4)
+
+    def test_connection_pool_compression(self):
+        server = LocalServer()
+        pool = ConnectionPool()
+        try:
+            for path in ('/gzip', '/deflate'):
+                self.assertEqual(pool.urlopen(server.url + path).read(),
+                                 LocalHandler.compressible)
+
+            stats = pool.stats()
+            self.assertEqual(stats['bytes_decoded'],
+                             2 * len(LocalHandler.compressible))
+            self.assertTrue(stats['bytes_wire'] * 10 < stats['bytes_decoded'])
+
+            # Leitura incremental, como no modo stream
+            resp = pool.urlopen(server.url + '/gzip')
+            chunks = []
+            while True:
+                chunk = resp.read(100)
+                if not chunk:
+                    break
+                self.assertTrue(len(chunk) <= 100)
+                chunks.append(chunk)
+            self.assertEqual(''.join(chunks), LocalHandler.compressible)
+            self.assertEqual(pool.idle_connections(), 1)
+        finally:
+            pool.clear()
+            server.stop()
+
+    def test_sqlite_cache(self):
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, 'cache.db')
+        try:
+            cache = SQLiteCache(path, max_entries=2)
+            cache.set('a', {'code': 200, 'data': '<Result/>'}, 60)
+            self.assertEqual(cache.get('a'),
+                             {'code': 200, 'data': '<Result/>'})
+            cache.set('b', 'b', -1)
+            self.assertEqual(cache.get('b'), None)
+
+            # Outro processo enxerga (e grava) o mesmo cache
+            child = multiprocessing.Process(target=_fill_cache, args=(path,))
+            child.start()
+            child.join()
+            self.assertEqual(cache.get('from-child'), {'code': 200})
+
+            cache.set('c', 'c', 10)
+            cache.compact()
+            self.assertEqual(len(cache), 2)
+            self.assertEqual(cache.get('c'), None)
+            self.assertEqual(cache.stats()['size'], 2)
+
+            # Camada em memória na frente do disco
+            memory = LRUCache()
+            tiered = TieredCache(memory, SQLiteCache(path))
+            self.assertEqual(tiered.get('a')['code'], 200)
+            self.assertEqual(memory.get('a')['code'], 200)
+
+            buscape = Buscape(self.applicationID, pool=FakePool(),
+                              cache=tiered)
+            buscape.view_product_details(productID=1)
+            self.assertEqual(len(SQLiteCache(path)), 3)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_stale_while_revalidate(self):
+        pool = FakePool(delay=0.2)
+        buscape = Buscape(self.applicationID, pool=pool, cache=LRUCache(),
+                          cache_ttls={'viewSellerDetails': 0.1},
+                          stale_ttls={'viewSellerDetails': 60})
+
+        buscape.view_seller_details(sellerID=1)
+        time.sleep(0.15)
+
+        # Passado o TTL a resposta antiga é devolvida na hora e atualizada
+        # em segundo plano, uma única vez
+        start = time.time()
+        buscape.view_seller_details(sellerID=1)
+        buscape.view_seller_details(sellerID=1)
+        self.assertTrue(time.time() - start < 0.1)
+
+        time.sleep(0.3)
+        self.assertEqual(len(pool.urls), 2)
+
+        # Depois do TTL + stale a chamada espera pela requisição
+        buscape = Buscape(self.applicationID, pool=pool, cache=LRUCache(),
+                          cache_ttls={'viewSellerDetails': 0.05},
+                          stale_ttls={'viewSellerDetails': 0.05})
+        buscape.view_seller_details(sellerID=1)
+        time.sleep(0.15)
+        start = time.time()
+        buscape.view_seller_details(sellerID=1)
+        self.assertTrue(time.time() - start >= 0.2)
+
+        class DictCache(dict):
+            def set(self, key, value, ttl):
+                self[key] = value
+
+        self.assertRaisesMessage(
+            ValueError, 'stale_ttls requires a cache with get_entry',
+            Buscape, self.applicationID, cache=DictCache(),
+            stale_ttls={'viewSellerDetails': 60})
+
+    def test_hooks_and_metrics(self):
+        buscape = Buscape(self.applicationID, pool=FakePool(),
+                          cache=LRUCache())
+        self.assertRaisesRegexp(ValueError, 'hook must be one of',
+                                buscape.add_hook, 'after', lambda e: None)
+
+        events = []
+        buscape.add_hook('before_request', lambda e: events.append(
+            ('before', e.method, e.status)))
+        buscape.add_hook('after_response', lambda e: events.append(
+            ('after', e.method, e.status, e.cache, e.size)))
+        buscape.add_hook('on_error', lambda e: events.append(
+            ('error', e.method, type(e.error))))
+        metrics = MetricsCollector().attach(buscape)
+
+        buscape.view_product_details(productID=1)
+        buscape.view_product_details(productID=1)
+        size = len(FakePool().data)
+        self.assertEqual(events, [
+            ('before', 'viewProductDetails', None),
+            ('after', 'viewProductDetails', 200, 'miss', size),
+            ('before', 'viewProductDetails', None),
+            ('after', 'viewProductDetails', 200, 'hit', size),
+        ])
+
+        del events[:]
+        buscape.pool = FlakyPool([HTTPError('url', 404, 'Not Found', {},
+                                            None)])
+        self.assertRaises(HTTPError, buscape.view_seller_details, sellerID=1)
+        self.assertEqual(events[-1], ('error', 'viewSellerDetails',
+                                      HTTPError))
+
+        text = metrics.export()
+        self.assertTrue('buscape_requests_total{cache="miss",'
+                        'method="viewProductDetails",status="200"} 1' in text)
+        self.assertTrue('buscape_requests_total{cache="miss",'
+                        'method="viewSellerDetails",status="404"} 1' in text)
+        self.assertTrue('buscape_request_duration_seconds_count'
+                        '{method="viewProductDetails"} 2' in text)
+        self.assertTrue('buscape_request_phase_seconds_count{method='
+                        '"viewProductDetails",phase="read"} 1' in text)
+        self.assertTrue('buscape_response_bytes_total{method='
+                        '"viewProductDetails"} %d' % (2 * size) in text)
+
+        # Lotes, páginas em stream e revalidações também geram eventos
+        del events[:]
+        buscape.pool = FakePool()
+        buscape.view_product_details_many([2, 3, 2])
+        self.assertEqual(sorted(events), [
+            ('after', 'viewProductDetails', 200, 'miss', size),
+            ('after', 'viewProductDetails', 200, 'miss', size),
+            ('before', 'viewProductDetails', None),
+            ('before', 'viewProductDetails', None),
+        ])
+
+        del events[:]
+        buscape.pool = PagedPool(total_pages=2)
+        offers = list(buscape.iter_offers(productID=1, stream=True))
+        self.assertEqual(len(offers), 4)
+        self.assertEqual([e[0] for e in events],
+                         ['before', 'after', 'before', 'after'])
+        self.assertEqual(events[1][:3], ('after', 'findOfferList', 200))
+        self.assertTrue(events[1][4] > 0)
+
+        del events[:]
+        buscape.pool = FakePool()
+        buscape.cache_ttls['viewSellerDetails'] = 0.05
+        buscape.stale_ttls['viewSellerDetails'] = 60
+        buscape.view_seller_details(sellerID=2)
+        time.sleep(0.1)
+        buscape.view_seller_details(sellerID=2)
+        # A revalidação termina em segundo plano, em qualquer ordem em
+        # relação à chamada que a disparou
+        start = time.time()
+        while buscape._revalidating and time.time() - start < 5:
+            time.sleep(0.01)
+        self.assertEqual(sorted(e[3] for e in events if e[0] == 'after'),
+                         ['miss', 'revalidate', 'stale'])
+
 
 class BuscapeRequestTest(BuscapeTest):
     def setUp(self):